@@ -0,0 +1,146 @@
+""" Startup time of the hearth CLI
+
+Runs quick commands in fresh interpreters and reports the median wall time
+of each. hearth is called from scripts and cron jobs often enough that
+startup cost adds up. Interpreter startup alone varies a lot between
+machines, so only an explicit target or a baseline from the same machine
+makes it fail.
+
+    python bench/import_time.py --command list --importtime
+    python bench/import_time.py --output before.json
+    python bench/import_time.py --baseline before.json
+
+Commands run against an empty home directory so they measure startup
+rather than whatever the local catalog holds.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import click
+
+DEFAULT_COMMANDS = ("--help", "list")
+
+_REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _env(home: str) -> Dict[str, str]:
+    python_path = [os.fspath(_REPO_ROOT)]
+    if os.environ.get("PYTHONPATH"):
+        python_path.append(os.environ["PYTHONPATH"])
+    env = dict(os.environ, HOME=home, PYTHONPATH=os.pathsep.join(python_path))
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    return env
+
+
+def time_command(args: List[str], home: str, repeat: int) -> List[float]:
+    """ Wall time of each run of `hearth <args>` """
+    cmd = [sys.executable, "-m", "hearth.main", *args]
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=_env(home), stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=False)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def slowest_imports(args: List[str], home: str, top: int) -> List[Tuple[int, str]]:
+    """ Modules with the highest cumulative import time, in microseconds """
+    cmd = [sys.executable, "-X", "importtime", "-m", "hearth.main", *args]
+    proc = subprocess.run(cmd, env=_env(home), stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, universal_newlines=True, check=False)
+
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            imports.append((int(cumulative), name.rstrip()))
+
+    return sorted(imports, reverse=True)[:top]
+
+
+def time_interpreter(repeat: int) -> List[float]:
+    """ Wall time of bare interpreter startups, for reference """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=False)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def _regressions(medians: Dict[str, float],
+                 baseline: Dict[str, float],
+                 tolerance: float) -> List[Tuple[str, float, float]]:
+    """ Commands slower than in the baseline by more than `tolerance` """
+    return [(command, baseline[command], ms) for command, ms in medians.items()
+            if command in baseline and ms > baseline[command] * (1 + tolerance)]
+
+
+@click.command()
+@click.option("--command", "commands", multiple=True,
+              help="Arguments to hearth, quoted as one (default: '--help' and 'list')")
+@click.option("--repeat", type=int, default=20, show_default=True)
+@click.option("--target-ms", type=float,
+              help="Fail when a command's median startup time is over this")
+@click.option("--importtime", "show_imports", is_flag=True,
+              help="Also list the slowest imports of each command")
+@click.option("--output", type=click.Path(dir_okay=False),
+              help="Write the medians to this file, for use as a baseline")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False),
+              help="Earlier medians to check for regressions against")
+@click.option("--tolerance", type=float, default=0.25, show_default=True,
+              help="Allowed slowdown against the baseline before failing")
+def main(commands, repeat, target_ms: Optional[float], show_imports, output, baseline,
+         tolerance):
+    interpreter = statistics.median(time_interpreter(repeat))
+    click.echo(f"{'python -c pass':<20} {interpreter * 1000:7.1f} ms", err=True)
+
+    failed = False
+    medians: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory(prefix="hearth-home-") as home:
+        for command in commands or DEFAULT_COMMANDS:
+            args = command.split()
+            # The first run warms the bytecode cache
+            time_command(args, home, 1)
+            medians[command] = statistics.median(time_command(args, home, repeat)) * 1000
+
+            over = target_ms is not None and medians[command] > target_ms
+            failed |= over
+            click.echo(f"{'hearth ' + command:<20} {medians[command]:7.1f} ms"
+                       f"{'  OVER TARGET' if over else ''}", err=True)
+
+            if show_imports:
+                for micros, name in slowest_imports(args, home, 15):
+                    click.echo(f"    {micros / 1000:7.1f} ms {name}", err=True)
+
+    if output:
+        Path(output).write_text(json.dumps({"python": interpreter * 1000,
+                                            "commands": medians}, indent=2))
+
+    if baseline:
+        slower = _regressions(medians,
+                              json.loads(Path(baseline).read_text())["commands"],
+                              tolerance)
+        for command, before, after in slower:
+            click.echo(f"REGRESSION hearth {command}: {before:.1f} ms -> {after:.1f} ms",
+                       err=True)
+        failed |= bool(slower)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+""" Benchmarks for scanning, diffing and syncing synthetic media trees
+
+Every scenario generates a source tree of one of the shapes in
+`helpers.tree_gen.SHAPES`, copies it, mutates the copy at a given change
+rate and then times loading both trees, diffing them, diffing them again
+through the asyncio pipeline and syncing the source onto the copy.
+Scenarios run in fresh processes so their peak RSS doesn't bleed into each
+other. Peak RSS only ever grows within a process, so it's reported per
+scenario rather than per phase.
+
+    python bench/run_bench.py --shape wide --shape deep --output after.json
+    python bench/run_bench.py --baseline before.json
+
+Trees are read back from the page cache, so numbers reflect hearth's own
+overhead rather than the disk's.
+"""
+import filecmp
+import json
+import multiprocessing
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from os import fspath
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import click
+
+_REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, fspath(_REPO_ROOT / "test"))
+sys.path.insert(0, fspath(_REPO_ROOT))
+
+from hearth.dir.data import loaded_dir  # noqa: E402
+from hearth.dir.diff import full_diff_dirs  # noqa: E402
+from hearth.dir.pipeline import DEFAULT_JOBS, pipelined_diff  # noqa: E402
+from hearth.dir.sync import apply_copy, sync_plan  # noqa: E402
+from helpers.tree_gen import SHAPES, TreeSpec, generate_tree, mutate_tree  # noqa: E402
+
+# One file each to rewrite, remove and add, so every shape exercises copying
+_MIN_CHANGES = 3
+
+
+@dataclass
+class PhaseResult:
+    scenario: str
+    phase: str
+    seconds: float
+    files: int
+    bytes: int
+    files_per_s: float
+    mb_per_s: float
+
+
+def _phase(scenario: str,
+           phase: str,
+           seconds: float,
+           files: int,
+           num_bytes: int) -> PhaseResult:
+    seconds = max(seconds, 1e-9)
+    return PhaseResult(
+        scenario,
+        phase,
+        seconds,
+        files,
+        num_bytes,
+        files / seconds,
+        num_bytes / seconds / (1 << 20)
+    )
+
+
+def _compared_bytes(same: int, changed: int, spec: TreeSpec) -> int:
+    """ Bytes filecmp reads to compare the files both trees have
+
+    Same files are read in full on both sides. Changed files only differ
+    in their first bytes, so filecmp stops after a buffer from each side.
+    """
+    return 2 * (same * spec.file_size + changed * min(spec.file_size, filecmp.BUFSIZE))
+
+
+def run_scenario(name: str,
+                 spec: TreeSpec,
+                 change_rate: float,
+                 workdir: str,
+                 jobs: int = DEFAULT_JOBS) -> Tuple[List[PhaseResult], int]:
+    """ Time every phase of a scenario
+
+    :returns: Phase results and the peak RSS in kilobytes across all of them
+    """
+    root = Path(tempfile.mkdtemp(prefix=f"{name}-", dir=workdir))
+    src = root / "src"
+    dst = root / "dst"
+    src.mkdir()
+
+    try:
+        files = generate_tree(src, spec, seed=1)
+        shutil.copytree(fspath(src), fspath(dst))
+        mutation = mutate_tree([dst / f.relative_to(src) for f in files], change_rate, seed=2,
+                               min_changes=_MIN_CHANGES)
+
+        results = []
+
+        start = time.perf_counter()
+        src_dir = loaded_dir(src)
+        dst_dir = loaded_dir(dst)
+        results.append(_phase(name, "loaded_dir", time.perf_counter() - start,
+                              2 * len(files), 0))
+
+        start = time.perf_counter()
+        diff = full_diff_dirs(src_dir, dst_dir)
+        elapsed = time.perf_counter() - start
+        # The diff folds away identical subdirectories, but their files
+        # got compared all the same
+        compared = len(files) - len(mutation.removed)
+        compared_bytes = _compared_bytes(compared - len(mutation.changed),
+                                         len(mutation.changed),
+                                         spec)
+        results.append(_phase(name, "full_diff_dirs", elapsed, compared, compared_bytes))
+
+        # Otherwise the comparisons above get answered from filecmp's cache
+        filecmp.clear_cache()
+        start = time.perf_counter()
+        pipelined_diff(src, dst, jobs)
+        results.append(_phase(name, "pipelined_diff", time.perf_counter() - start,
+                              compared, compared_bytes))
+
+        plan = sync_plan(src, dst, diff)
+        copied = sum(Path(op.src).stat().st_size for op in plan if not op.is_dir)
+        start = time.perf_counter()
+        for op in plan:
+            apply_copy(op)
+        results.append(_phase(name, "sync", time.perf_counter() - start,
+                              len(plan), copied))
+
+        # Kilobytes on Linux
+        return results, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    finally:
+        shutil.rmtree(fspath(root), ignore_errors=True)
+
+
+def _regressions(results: List[Dict],
+                 baseline: List[Dict],
+                 tolerance: float) -> List[Tuple[str, str, float, float]]:
+    before = {(r["scenario"], r["phase"]): r["seconds"] for r in baseline}
+
+    slower = []
+    for r in results:
+        key = (r["scenario"], r["phase"])
+        if key in before and r["seconds"] > before[key] * (1 + tolerance):
+            slower.append((r["scenario"], r["phase"], before[key], r["seconds"]))
+
+    return slower
+
+
+@click.command()
+@click.option("--shape", "shapes", multiple=True, type=click.Choice(sorted(SHAPES)),
+              help="Tree shapes to run (default: all)")
+@click.option("--scale", type=float, default=1.0, show_default=True,
+              help="Multiplier for the number of files per directory")
+@click.option("--change-rate", type=float, default=0.05, show_default=True,
+              help="Share of files changed, removed or added in the copy")
+@click.option("--repeat", type=int, default=1, show_default=True,
+              help="Runs per scenario; the fastest run of each phase is kept")
+@click.option("--workdir", type=click.Path(file_okay=False),
+              help="Where to generate trees (default: system temp dir)")
+@click.option("--jobs", type=int, default=DEFAULT_JOBS, show_default=True,
+              help="I/O calls in flight for the pipelined diff")
+@click.option("--output", type=click.Path(dir_okay=False),
+              default="bench-results.json", show_default=True)
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False),
+              help="Earlier results to check for regressions against")
+@click.option("--tolerance", type=float, default=0.25, show_default=True,
+              help="Allowed slowdown against the baseline before failing")
+def main(shapes, scale, change_rate, repeat, workdir, jobs, output, baseline, tolerance):
+    ctx = multiprocessing.get_context("spawn")
+    results: List[PhaseResult] = []
+    peak_rss: Dict[str, int] = {}
+
+    for name in shapes or sorted(SHAPES):
+        spec = SHAPES[name].scaled(scale)
+        click.echo(f"{name}: {spec.num_files} files of {spec.file_size} bytes",
+                   err=True)
+
+        best: Dict[str, PhaseResult] = {}
+        for _ in range(repeat):
+            with ctx.Pool(1) as pool:
+                phases, rss_kb = pool.apply(run_scenario,
+                                            (name, spec, change_rate, workdir, jobs))
+            for r in phases:
+                if r.phase not in best or r.seconds < best[r.phase].seconds:
+                    best[r.phase] = r
+            peak_rss[name] = max(peak_rss.get(name, 0), rss_kb)
+        scenario_results = list(best.values())
+
+        for r in scenario_results:
+            click.echo(f"  {r.phase:<15} {r.seconds:9.3f}s"
+                       f" {r.files_per_s:12.0f} files/s {r.mb_per_s:10.1f} MB/s", err=True)
+        click.echo(f"  {peak_rss[name] // 1024} MB peak RSS", err=True)
+        results.extend(scenario_results)
+
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scale": scale,
+            "change_rate": change_rate,
+            "jobs": jobs,
+        },
+        "results": [asdict(r) for r in results],
+        "peak_rss_kb": peak_rss,
+    }
+    Path(output).write_text(json.dumps(report, indent=2))
+
+    if baseline:
+        slower = _regressions(report["results"],
+                              json.loads(Path(baseline).read_text())["results"],
+                              tolerance)
+        for scenario, phase, before, after in slower:
+            click.echo(f"REGRESSION {scenario}/{phase}: {before:.3f}s -> {after:.3f}s",
+                       err=True)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,704 @@
+from __future__ import annotations
+
+import logging
+import re
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+from os import PathLike, fspath, getpid, kill, scandir, stat
+from os.path import join as ojoin
+from os.path import relpath
+from pathlib import Path
+from typing import AbstractSet, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from hearth.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    last_scanned TEXT
+);
+
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    root_id INTEGER NOT NULL REFERENCES roots(id) ON DELETE CASCADE,
+    parent_id INTEGER REFERENCES entries(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    mtime INTEGER NOT NULL DEFAULT 0,
+    total_size INTEGER NOT NULL DEFAULT 0,
+    total_files INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (root_id, path)
+);
+
+CREATE INDEX IF NOT EXISTS entries_parent ON entries(parent_id);
+-- Size and time filters in searches
+CREATE INDEX IF NOT EXISTS entries_size ON entries(total_size);
+CREATE INDEX IF NOT EXISTS entries_mtime ON entries(mtime);
+
+-- Directories changed since the last refresh, as reported by a watcher.
+-- One row per directory, however often it changes until the next refresh.
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY,
+    root_id INTEGER NOT NULL REFERENCES roots(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    recursive INTEGER NOT NULL,
+    UNIQUE (root_id, path)
+);
+
+CREATE TABLE IF NOT EXISTS watchers (
+    root_id INTEGER PRIMARY KEY REFERENCES roots(id) ON DELETE CASCADE,
+    pid INTEGER NOT NULL
+);
+
+-- Subtrees a watcher couldn't watch, e.g. after running out of watches
+CREATE TABLE IF NOT EXISTS unwatched (
+    root_id INTEGER NOT NULL REFERENCES roots(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    UNIQUE (root_id, path)
+);
+"""
+
+# Journals from before it had one row per directory get their rows merged
+_JOURNAL_MIGRATION = """
+CREATE TABLE journal_merged (
+    id INTEGER PRIMARY KEY,
+    root_id INTEGER NOT NULL REFERENCES roots(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    recursive INTEGER NOT NULL,
+    UNIQUE (root_id, path)
+);
+
+INSERT INTO journal_merged (root_id, path, recursive)
+    SELECT root_id, path, MAX(recursive) FROM journal GROUP BY root_id, path;
+
+DROP TABLE journal;
+ALTER TABLE journal_merged RENAME TO journal;
+"""
+
+_JOURNAL_UPSERT = (
+    "INSERT INTO journal (root_id, path, recursive) VALUES (?, ?, ?)"
+    " ON CONFLICT (root_id, path) DO UPDATE SET recursive = recursive OR excluded.recursive"
+)
+
+# Trigram index over entry names, kept in sync with `entries` by triggers.
+# Cascading deletes fire the delete trigger too, so removed subtrees drop out.
+# The trigram tokenizer needs SQLite 3.34; older ones get `_NAME_INDEX`.
+_NAMES_SCHEMA = """
+CREATE VIRTUAL TABLE names USING fts5(
+    name,
+    content='entries',
+    content_rowid='id',
+    tokenize='trigram'
+);
+
+CREATE TRIGGER entries_names_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO names (rowid, name) VALUES (new.id, new.name);
+END;
+
+CREATE TRIGGER entries_names_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO names (names, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+
+INSERT INTO names (names) VALUES ('rebuild');
+"""
+
+_NAME_INDEX = "CREATE INDEX IF NOT EXISTS entries_name ON entries(name)"
+
+# Shortest literal the trigram index can look up
+_MIN_TRIGRAM_LEN = 3
+
+
+@dataclass
+class RootSummary:
+    path: str
+    total_size: int
+    total_files: int
+    last_scanned: Optional[datetime]
+
+
+@dataclass
+class SearchQuery:
+    """ Filters for a catalog search; unset filters match everything
+
+    `glob` is matched case-sensitively against entry names while
+    `substring` is matched case-insensitively. Times are POSIX timestamps.
+    """
+    glob: Optional[str] = None
+    substring: Optional[str] = None
+    min_size: Optional[int] = None
+    max_size: Optional[int] = None
+    newer_than: Optional[float] = None
+    older_than: Optional[float] = None
+    is_dir: Optional[bool] = None
+    roots: Optional[List[str]] = None
+    limit: Optional[int] = None
+
+
+@dataclass
+class SearchResult:
+    root: str
+    path: str
+    is_dir: bool
+    size: int
+    mtime: datetime
+
+    @property
+    def fullpath(self) -> str:
+        return ojoin(self.root, self.path) if self.path else self.root
+
+
+@dataclass
+class _Entry:
+    id: int
+    is_dir: bool
+    size: int
+    mtime: int
+    total_size: int = 0
+    total_files: int = 0
+
+
+class CatalogError(Exception):
+    pass
+
+
+class Catalog:
+    """ Persistent scan index of every tracked root directory
+
+    Each directory row keeps the byte and file totals of its whole subtree,
+    so summaries are a single lookup instead of a tree walk.
+    """
+
+    def __init__(self, path: PathLike) -> None:
+        self.path = Path(path)
+        self._conn = sqlite3.connect(fspath(self.path))
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.executescript(_SCHEMA)
+
+        journal_is_unique = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = 'journal'"
+        ).fetchone()
+        if not journal_is_unique:
+            self._conn.executescript(_JOURNAL_MIGRATION)
+
+        self._has_names = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'names'"
+        ).fetchone() is not None
+        if not self._has_names:
+            try:
+                self._conn.executescript(_NAMES_SCHEMA)
+                self._has_names = True
+            except sqlite3.OperationalError as e:
+                logger.debug("Searching names without a trigram index (SQLite %s): %s",
+                             sqlite3.sqlite_version, e)
+                self._conn.execute(_NAME_INDEX)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> Catalog:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def root_summary(self, root: Union[str, PathLike]) -> Optional[RootSummary]:
+        """ Summary of an indexed root, or None if it was never scanned """
+        row = self._conn.execute(
+            "SELECT r.path, e.total_size, e.total_files, r.last_scanned"
+            " FROM roots r JOIN entries e"
+            " ON e.root_id = r.id AND e.parent_id IS NULL"
+            " WHERE r.path = ?",
+            (_root_key(root),)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        path, total_size, total_files, last_scanned = row
+        return RootSummary(
+            path,
+            total_size,
+            total_files,
+            datetime.fromisoformat(last_scanned) if last_scanned else None
+        )
+
+    def search(self, query: SearchQuery) -> Iterator[SearchResult]:
+        """ Find indexed files and directories across every scanned root
+
+        Name filters go through the trigram index whenever they contain a
+        literal of at least three characters, so lookups don't scan the
+        whole catalog. Without one, only globs starting with a literal avoid
+        that. Size and time filters are indexed too, though broad ranges
+        still visit every entry in them. Roots don't need to be mounted to
+        be searched.
+        """
+        clauses: List[str] = []
+        params: List[object] = []
+
+        literals = []
+        if query.substring:
+            if self._has_names and len(query.substring) >= _MIN_TRIGRAM_LEN:
+                literals.append(query.substring)
+            else:
+                clauses.append("instr(lower(e.name), lower(?)) > 0")
+                params.append(query.substring)
+
+        if query.glob:
+            if self._has_names:
+                literals.extend(_glob_literals(query.glob))
+            clauses.append("e.name GLOB ?")
+            params.append(query.glob)
+
+        if query.min_size is not None:
+            clauses.append("e.total_size >= ?")
+            params.append(query.min_size)
+        if query.max_size is not None:
+            clauses.append("e.total_size <= ?")
+            params.append(query.max_size)
+        if query.newer_than is not None:
+            clauses.append("e.mtime >= ?")
+            params.append(int(query.newer_than * 1e9))
+        if query.older_than is not None:
+            clauses.append("e.mtime < ?")
+            params.append(int(query.older_than * 1e9))
+        if query.is_dir is not None:
+            clauses.append("e.is_dir = ?")
+            params.append(int(query.is_dir))
+        if query.roots:
+            keys = [_root_key(r) for r in query.roots]
+            clauses.append(f"r.path IN ({', '.join('?' * len(keys))})")
+            params.extend(keys)
+
+        # Root directories themselves aren't results, only their contents
+        clauses.append("e.parent_id IS NOT NULL")
+
+        if literals:
+            sql = ("SELECT r.path, e.path, e.is_dir, e.total_size, e.mtime"
+                   " FROM names JOIN entries e ON e.id = names.rowid"
+                   " JOIN roots r ON r.id = e.root_id"
+                   " WHERE names MATCH ?")
+            params.insert(0, " AND ".join(_fts_phrase(l) for l in literals))
+        else:
+            sql = ("SELECT r.path, e.path, e.is_dir, e.total_size, e.mtime"
+                   " FROM entries e JOIN roots r ON r.id = e.root_id"
+                   " WHERE 1")
+
+        sql += "".join(f" AND {c}" for c in clauses)
+        if query.limit is not None:
+            sql += " LIMIT ?"
+            params.append(query.limit)
+
+        for root, path, is_dir, size, mtime in self._conn.execute(sql, params):
+            yield SearchResult(root,
+                               path,
+                               bool(is_dir),
+                               size,
+                               datetime.fromtimestamp(mtime / 1e9))
+
+    def refresh_root(self, root: Union[str, PathLike]) -> RootSummary:
+        """ Bring the index of a root directory up to date
+
+        Only directories whose mtime changed since the last scan are listed
+        again; unchanged directories reuse their stored entries and only have
+        their rollups recomputed. A file rewritten in place doesn't touch its
+        directory's mtime, so such edits are picked up on the next relisting.
+
+        While a watcher is running for the root, only the directories it
+        journaled (and subtrees it couldn't watch) are looked at.
+        """
+        root_path = _root_key(root)
+        if not Path(root_path).is_dir():
+            raise CatalogError(f"'{root_path}' is not a directory")
+
+        with self._conn:
+            root_id = self._root_id(root_path)
+            top_entry = self._entry(root_id, "")
+            journal = self._take_journal(root_id)
+
+            if top_entry is not None and self._is_watched(root_id):
+                journal.update((p, True) for p in self._unwatched(root_id))
+                self._refresh_journaled(root_id, root_path, journal)
+            elif top_entry is None:
+                cur = self._conn.execute(
+                    "INSERT INTO entries (root_id, parent_id, name, path, is_dir, mtime)"
+                    " VALUES (?, NULL, ?, '', 1, -1)",
+                    (root_id, Path(root_path).name)
+                )
+                top_entry = _Entry(_row_id(cur), True, 0, -1)
+                self._refresh_dir(root_id, top_entry, root_path, "")
+            else:
+                self._refresh_dir(root_id, top_entry, root_path, "",
+                                  force=journal.keys())
+            self._conn.execute(
+                "UPDATE roots SET last_scanned = ? WHERE id = ?",
+                (datetime.now().isoformat(), root_id)
+            )
+
+        summary = self.root_summary(root_path)
+        assert summary is not None
+        return summary
+
+    def relocate(self, moves: Dict[str, str]) -> None:
+        """ Move indexed roots along with the mountpoints they live under
+
+        :param moves: New mountpoint of every device that moved, keyed by
+                      its old mountpoint
+        """
+        updates = []
+        for root_id, path in self._conn.execute("SELECT id, path FROM roots"):
+            new_path = rebased_path(path, moves)
+            if new_path is not None:
+                updates.append((new_path, root_id))
+
+        if not updates:
+            return
+
+        with self._conn:
+            moved_ids = [(root_id,) for _, root_id in updates]
+            # Indexes still sitting at the new paths are from older mounts
+            self._conn.executemany(
+                "DELETE FROM roots WHERE path = ? AND id != ?", updates
+            )
+            # Park moved roots first so devices swapping mountpoints don't collide
+            self._conn.executemany(
+                "UPDATE roots SET path = '//relocating/' || id WHERE id = ?", moved_ids
+            )
+            self._conn.executemany("UPDATE roots SET path = ? WHERE id = ?", updates)
+
+        logger.info("Relocated %d indexed roots", len(updates))
+
+    def start_watching(self, root: Union[str, PathLike]) -> None:
+        """ Record that a watcher now journals every change under a root
+
+        Whatever changed before the watcher started isn't journaled, so the
+        next refresh still goes over the whole root once.
+        """
+        with self._conn:
+            root_id = self._root_id(_root_key(root))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO watchers (root_id, pid) VALUES (?, ?)",
+                (root_id, getpid())
+            )
+            self._conn.execute("DELETE FROM unwatched WHERE root_id = ?", (root_id,))
+            self._conn.execute(_JOURNAL_UPSERT, (root_id, "", 1))
+
+    def stop_watching(self, root: Union[str, PathLike]) -> None:
+        with self._conn:
+            root_id = self._root_id(_root_key(root))
+            self._conn.execute("DELETE FROM watchers WHERE root_id = ?", (root_id,))
+            self._conn.execute("DELETE FROM unwatched WHERE root_id = ?", (root_id,))
+
+    def mark_unwatched(self, root: Union[str, PathLike], path: Union[str, PathLike]) -> None:
+        """ Rescan a subtree on every refresh since its changes aren't journaled """
+        root_path = _root_key(root)
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO unwatched (root_id, path) VALUES (?, ?)",
+                (self._root_id(root_path), _rel_key(root_path, path))
+            )
+
+    def journal_changes(self,
+                        changes: Iterable[Tuple[Union[str, PathLike],
+                                                Union[str, PathLike],
+                                                bool]]) -> None:
+        """ Journal changed directories
+
+        :param changes: Root, changed directory and whether everything below
+                        that directory needs to be looked at as well
+        """
+        rows = []
+        root_ids: Dict[str, int] = {}
+        with self._conn:
+            for root, path, recursive in changes:
+                root_path = _root_key(root)
+                if root_path not in root_ids:
+                    root_ids[root_path] = self._root_id(root_path)
+                rows.append((root_ids[root_path],
+                             _rel_key(root_path, path),
+                             int(recursive)))
+
+            self._conn.executemany(_JOURNAL_UPSERT, rows)
+
+    def _take_journal(self, root_id: int) -> Dict[str, bool]:
+        journal = {
+            path: bool(recursive) for path, recursive in self._conn.execute(
+                "SELECT path, recursive FROM journal WHERE root_id = ?", (root_id,))
+        }
+
+        self._conn.execute("DELETE FROM journal WHERE root_id = ?", (root_id,))
+        return journal
+
+    def _is_watched(self, root_id: int) -> bool:
+        row = self._conn.execute(
+            "SELECT pid FROM watchers WHERE root_id = ?", (root_id,)
+        ).fetchone()
+
+        if row is None:
+            return False
+
+        try:
+            kill(row[0], 0)
+        except ProcessLookupError:
+            logger.warning("Watcher %d is gone without unregistering itself", row[0])
+            self._conn.execute("DELETE FROM watchers WHERE root_id = ?", (root_id,))
+            self._conn.execute("DELETE FROM unwatched WHERE root_id = ?", (root_id,))
+            return False
+        except PermissionError:
+            pass
+
+        return True
+
+    def _unwatched(self, root_id: int) -> List[str]:
+        return [
+            path for path, in self._conn.execute(
+                "SELECT path FROM unwatched WHERE root_id = ?", (root_id,))
+        ]
+
+    def _refresh_journaled(self,
+                           root_id: int,
+                           root_path: str,
+                           journal: Dict[str, bool]) -> None:
+        # Parents go first so that their relisting drops removed children
+        # before we'd try to look at them
+        ancestors: Set[str] = set()
+        for rel_path in sorted(journal, key=_depth):
+            entry = self._entry(root_id, rel_path)
+            if entry is None or not entry.is_dir:
+                continue
+
+            try:
+                self._refresh_dir(root_id,
+                                  entry,
+                                  ojoin(root_path, rel_path) if rel_path else root_path,
+                                  rel_path,
+                                  force={rel_path},
+                                  descend=journal[rel_path])
+            except FileNotFoundError:
+                logger.debug("Journaled directory %s is gone", rel_path)
+                continue
+
+            ancestors.update(_ancestors(rel_path))
+
+        for rel_path in sorted(ancestors, key=_depth, reverse=True):
+            entry = self._entry(root_id, rel_path)
+            if entry is not None:
+                self._rollup(entry.id)
+
+    def _rollup(self, dir_id: int) -> None:
+        self._conn.execute(
+            "UPDATE entries SET (size, total_size, total_files) = ("
+            "   SELECT COALESCE(SUM(CASE WHEN is_dir = 0 THEN size END), 0),"
+            "          COALESCE(SUM(total_size), 0),"
+            "          COALESCE(SUM(total_files), 0)"
+            "   FROM entries WHERE parent_id = ?"
+            ") WHERE id = ?",
+            (dir_id, dir_id)
+        )
+
+    def _entry(self, root_id: int, rel_path: str) -> Optional[_Entry]:
+        row = self._conn.execute(
+            "SELECT id, is_dir, size, mtime, total_size, total_files FROM entries"
+            " WHERE root_id = ? AND path = ?",
+            (root_id, rel_path)
+        ).fetchone()
+
+        return None if row is None else _Entry(row[0], bool(row[1]), *row[2:])
+
+    def _root_id(self, root_path: str) -> int:
+        row = self._conn.execute(
+            "SELECT id FROM roots WHERE path = ?", (root_path,)
+        ).fetchone()
+
+        if row is not None:
+            return row[0]
+
+        return _row_id(self._conn.execute(
+            "INSERT INTO roots (path) VALUES (?)", (root_path,)
+        ))
+
+    def _children(self, dir_id: int) -> Dict[str, _Entry]:
+        return {
+            name: _Entry(id_, bool(is_dir), size, mtime, total_size, total_files)
+            for id_, name, is_dir, size, mtime, total_size, total_files
+            in self._conn.execute(
+                "SELECT id, name, is_dir, size, mtime, total_size, total_files"
+                " FROM entries WHERE parent_id = ?",
+                (dir_id,)
+            )
+        }
+
+    def _refresh_dir(self,
+                     root_id: int,
+                     dir_entry: _Entry,
+                     abs_path: str,
+                     rel_path: str,
+                     force: AbstractSet[str] = frozenset(),
+                     descend: bool = True) -> Tuple[int, int]:
+        """ Refresh a directory and its rollups
+
+        :param force: Relative paths to relist even if their mtime is unchanged
+        :param descend: Whether to refresh subdirectories that were already
+                        indexed, or to reuse their stored rollups
+        """
+        mtime = stat(abs_path).st_mtime_ns
+        metrics.count("stats_issued")
+        children = self._children(dir_entry.id)
+
+        if mtime != dir_entry.mtime or rel_path in force:
+            logger.debug("Relisting dirty directory %s", abs_path)
+            children = self._relist_dir(root_id, dir_entry.id, abs_path,
+                                        rel_path, children)
+
+        own_size = 0
+        total_size = 0
+        total_files = 0
+        for name, child in children.items():
+            if child.is_dir and not descend and child.mtime != -1:
+                total_size += child.total_size
+                total_files += child.total_files
+            elif child.is_dir:
+                sub_size, sub_files = self._refresh_dir(
+                    root_id,
+                    child,
+                    ojoin(abs_path, name),
+                    ojoin(rel_path, name) if rel_path else name,
+                    force=force,
+                    descend=descend
+                )
+                total_size += sub_size
+                total_files += sub_files
+            else:
+                own_size += child.size
+                total_files += 1
+
+        total_size += own_size
+        self._conn.execute(
+            "UPDATE entries SET size = ?, mtime = ?, total_size = ?, total_files = ?"
+            " WHERE id = ?",
+            (own_size, mtime, total_size, total_files, dir_entry.id)
+        )
+
+        return total_size, total_files
+
+    def _relist_dir(self,
+                    root_id: int,
+                    dir_id: int,
+                    abs_path: str,
+                    rel_path: str,
+                    children: Dict[str, _Entry]) -> Dict[str, _Entry]:
+        listed: Dict[str, _Entry] = {}
+        metrics.count("dirs_listed")
+
+        with scandir(abs_path) as it:
+            for entry in it:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if not is_dir and not entry.is_file(follow_symlinks=False):
+                    continue
+
+                old = children.pop(entry.name, None)
+                if old is not None and old.is_dir != is_dir:
+                    self._conn.execute("DELETE FROM entries WHERE id = ?", (old.id,))
+                    old = None
+
+                if is_dir:
+                    # Subdirectories get their size and mtime once they're refreshed
+                    size = 0
+                    mtime = -1 if old is None else old.mtime
+                    totals = (0, 0) if old is None else (old.total_size, old.total_files)
+                else:
+                    st = entry.stat(follow_symlinks=False)
+                    metrics.count("stats_issued")
+                    size, mtime = st.st_size, st.st_mtime_ns
+                    totals = (size, 1)
+
+                if old is None:
+                    entry_id = _row_id(self._conn.execute(
+                        "INSERT INTO entries"
+                        " (root_id, parent_id, name, path, is_dir, size, mtime,"
+                        "  total_size, total_files)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (root_id, dir_id, entry.name,
+                         ojoin(rel_path, entry.name) if rel_path else entry.name,
+                         int(is_dir), size, mtime, size, int(not is_dir))
+                    ))
+                elif not is_dir and (old.size, old.mtime) != (size, mtime):
+                    entry_id = old.id
+                    self._conn.execute(
+                        "UPDATE entries SET size = ?, mtime = ?, total_size = ?"
+                        " WHERE id = ?",
+                        (size, mtime, size, entry_id)
+                    )
+                else:
+                    entry_id = old.id
+                    size = old.size
+
+                listed[entry.name] = _Entry(entry_id, is_dir, size, mtime, *totals)
+
+        # Whatever wasn't listed anymore has been removed from disk
+        self._conn.executemany(
+            "DELETE FROM entries WHERE id = ?",
+            [(e.id,) for e in children.values()]
+        )
+
+        return listed
+
+
+def _glob_literals(pattern: str) -> List[str]:
+    """ Literal runs of a glob pattern long enough for the trigram index """
+    without_classes = re.sub(r"\[[^\]]*\]", "*", pattern)
+    return [
+        chunk for chunk in re.split(r"[*?]", without_classes)
+        if len(chunk) >= _MIN_TRIGRAM_LEN
+    ]
+
+
+def _fts_phrase(literal: str) -> str:
+    escaped = literal.replace('"', '""')
+    return f'"{escaped}"'
+
+
+def _row_id(cur: sqlite3.Cursor) -> int:
+    """ Id of the row an INSERT just added """
+    if cur.lastrowid is None:
+        raise CatalogError("Insert didn't add a row")
+
+    return cur.lastrowid
+
+
+def _root_key(root: Union[str, PathLike]) -> str:
+    return fspath(Path(root).resolve())
+
+
+def rebased_path(path: str, moves: Dict[str, str]) -> Optional[str]:
+    """ Path under the new mountpoint, or None if none of the mounts moved
+
+    :param moves: New mountpoints keyed by old ones; the longest old
+                  mountpoint containing the path wins
+    """
+    containing = [m for m in moves if path == m or path.startswith(m.rstrip("/") + "/")]
+    if not containing:
+        return None
+
+    old = max(containing, key=len)
+    rel_path = relpath(path, old)
+    return moves[old] if rel_path == "." else ojoin(moves[old], rel_path)
+
+
+def _rel_key(root_path: str, path: Union[str, PathLike]) -> str:
+    rel_path = relpath(fspath(path), root_path)
+    return "" if rel_path == "." else rel_path
+
+
+def _depth(rel_path: str) -> int:
+    return rel_path.count("/") + 1 if rel_path else 0
+
+
+def _ancestors(rel_path: str) -> List[str]:
+    parts = rel_path.split("/") if rel_path else []
+    return ["/".join(parts[:i]) for i in range(len(parts))]
@@ -0,0 +1,261 @@
+""" Talking to a hearth daemon from the CLI
+
+Only imports what it takes to send a request, since every command that can
+go through the daemon imports this before it knows whether one is running.
+See `hearth.daemon` for the protocol. The result types of the `remote_*`
+helpers get imported once a daemon has answered.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import socket
+from dataclasses import asdict, is_dataclass
+from datetime import datetime
+from os import PathLike, fspath
+from pathlib import Path
+from typing import (TYPE_CHECKING, Any, BinaryIO, Dict, Iterator, List, Optional, Sequence,
+                    Tuple, Union)
+
+if TYPE_CHECKING:
+    from hearth.catalog import SearchQuery, SearchResult
+    from hearth.dir.diff import DirDiff
+    from hearth.dir.output import Entry
+    from hearth.dir.sync import CopyOp
+    from hearth.stats import Stats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_FILENAME = ".hearth.sock"
+DEFAULT_SOCKET_PATH: Path = Path.home() / DEFAULT_SOCKET_FILENAME
+
+# Seconds to wait for a daemon to take a connection, and to accept a request
+CONNECT_TIMEOUT = 1.0
+ACCEPT_TIMEOUT = 5.0
+
+
+class DaemonError(Exception):
+    pass
+
+
+def to_json(obj: Any) -> Any:
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if is_dataclass(obj) and not isinstance(obj, type):
+        return asdict(obj)
+
+    raise TypeError(f"Can't serialize {type(obj).__name__}")
+
+
+def _send(command: str,
+          socket_path: PathLike,
+          timeout: float,
+          args: Dict[str, Any]) -> Optional[Tuple[socket.socket, BinaryIO, Dict[str, Any]]]:
+    """ Send a request and read the first line of the reply
+
+    Only connecting and getting the request accepted can time out, after
+    that the daemon is doing the work and it gets waited for.
+
+    :returns: The connection, a reader over it and the first line, or None
+        if no daemon accepts the request in time
+    """
+    if not Path(socket_path).exists():
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(fspath(socket_path))
+        sock.sendall(json.dumps({"command": command, "args": args},
+                                default=to_json).encode() + b"\n")
+        sock.settimeout(timeout)
+        f = sock.makefile("rb")
+        accepted = f.readline()
+    except (ConnectionRefusedError, FileNotFoundError):
+        sock.close()
+        return None
+    except socket.timeout:
+        sock.close()
+        logger.warning("Daemon didn't accept '%s' in time, doing it here instead", command)
+        return None
+    except BaseException:
+        sock.close()
+        raise
+
+    try:
+        if not accepted:
+            raise DaemonError(f"Daemon closed the connection before accepting '{command}'")
+        sock.settimeout(None)
+        line = f.readline()
+    except BaseException:
+        f.close()
+        sock.close()
+        raise
+
+    res = json.loads(line) if line else None
+    if res is None or not res["ok"]:
+        f.close()
+        sock.close()
+        if res is None:
+            raise DaemonError(f"Daemon closed the connection during '{command}'")
+        raise DaemonError(res["error"])
+
+    return sock, f, res
+
+
+def request(command: str,
+            socket_path: PathLike = DEFAULT_SOCKET_PATH,
+            timeout: float = ACCEPT_TIMEOUT,
+            **args: Any) -> Optional[Any]:
+    """ Send a request to the daemon
+
+    :param timeout: Seconds to wait for the daemon to accept the request
+    :returns: The request's result, or None if no daemon accepts it in time
+    :raises DaemonError: If the daemon couldn't fulfill the request
+    """
+    sent = _send(command, socket_path, timeout, args)
+    if sent is None:
+        return None
+
+    sock, f, res = sent
+    f.close()
+    sock.close()
+    if res.get("stream"):
+        raise DaemonError(f"'{command}' streams its result, use stream_request")
+
+    return res["result"]
+
+
+def stream_request(command: str,
+                   socket_path: PathLike = DEFAULT_SOCKET_PATH,
+                   timeout: float = ACCEPT_TIMEOUT,
+                   **args: Any) -> Optional[Iterator[Any]]:
+    """ Send a request whose result the daemon streams back an item at a time
+
+    :param timeout: Seconds to wait for the daemon to accept the request
+    :returns: The result's items, or None if no daemon accepts it in time
+    :raises DaemonError: If the daemon couldn't fulfill the request, or
+        stopped halfway through streaming it
+    """
+    sent = _send(command, socket_path, timeout, args)
+    if sent is None:
+        return None
+
+    sock, f, res = sent
+    if not res.get("stream"):
+        f.close()
+        sock.close()
+        raise DaemonError(f"'{command}' doesn't stream its result, use request")
+
+    return _streamed(command, sock, f)
+
+
+def _streamed(command: str, sock: socket.socket, f: BinaryIO) -> Iterator[Any]:
+    with sock, f:
+        for line in f:
+            item = json.loads(line)
+            if item is None:
+                return
+            yield item
+
+    raise DaemonError(f"Daemon closed the connection during '{command}'")
+
+
+def is_running(socket_path: PathLike = DEFAULT_SOCKET_PATH) -> bool:
+    try:
+        return request("ping", socket_path, CONNECT_TIMEOUT) == "pong"
+    except DaemonError:
+        return False
+
+
+def remote_diff_entries(src: PathLike,
+                        target: PathLike,
+                        statuses: Sequence[str],
+                        socket_path: PathLike = DEFAULT_SOCKET_PATH
+                        ) -> Optional[Iterator[Entry]]:
+    """ Entries of the diff between two trees, as `hearth.dir.output.diff_entries` yields them """
+    entries = stream_request("compare", socket_path,
+                             src=_abspath(src),
+                             target=_abspath(target),
+                             statuses=list(statuses))
+    if entries is None:
+        return None
+
+    return ((entry_type, status, path) for entry_type, status, path in entries)
+
+
+def remote_compare(src: PathLike,
+                   target: PathLike,
+                   socket_path: PathLike = DEFAULT_SOCKET_PATH) -> Optional[DirDiff]:
+    from hearth.dir.diff import DirDiff
+    from hearth.dir.output import STATUSES
+
+    entries = remote_diff_entries(src, target, STATUSES, socket_path)
+    if entries is None:
+        return None
+
+    diff = DirDiff()
+    for entry_type, status, path in entries:
+        getattr(diff.files if entry_type == "file" else diff.subdirs, status).add(path)
+
+    return diff
+
+
+def remote_stats(roots: List[str],
+                 refresh: bool,
+                 socket_path: PathLike = DEFAULT_SOCKET_PATH) -> Optional[Stats]:
+    from hearth.catalog import RootSummary
+    from hearth.stats import DeviceStats, Stats
+
+    res = request("stats", socket_path,
+                  roots=[_abspath(r) for r in roots], refresh=refresh)
+    if res is None:
+        return None
+
+    return Stats(
+        devices=[DeviceStats(**d) for d in res["devices"]],
+        roots={
+            root: None if s is None else RootSummary(
+                s["path"],
+                s["total_size"],
+                s["total_files"],
+                datetime.fromisoformat(s["last_scanned"]) if s["last_scanned"] else None
+            )
+            for root, s in res["roots"].items()
+        }
+    )
+
+
+def remote_search(query: SearchQuery,
+                  socket_path: PathLike = DEFAULT_SOCKET_PATH) -> Optional[List[SearchResult]]:
+    from hearth.catalog import SearchResult
+
+    res = request("search", socket_path, query=query)
+    if res is None:
+        return None
+
+    return [
+        SearchResult(r["root"], r["path"], r["is_dir"], r["size"],
+                     datetime.fromisoformat(r["mtime"]))
+        for r in res
+    ]
+
+
+def remote_sync_plan(master: PathLike,
+                     backup: PathLike,
+                     socket_path: PathLike = DEFAULT_SOCKET_PATH) -> Optional[List[CopyOp]]:
+    from hearth.dir.sync import CopyOp
+
+    res = request("sync_plan", socket_path,
+                  master=_abspath(master), backup=_abspath(backup))
+    if res is None:
+        return None
+
+    return [CopyOp(**op) for op in res]
+
+
+def _abspath(path: Union[str, PathLike]) -> str:
+    # The daemon's working directory isn't the client's
+    return fspath(Path(path).resolve())
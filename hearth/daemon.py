@@ -0,0 +1,396 @@
+""" Long-running hearth process that keeps indexes warm between commands
+
+The daemon listens on a local Unix socket and answers one JSON request per
+connection, each in a thread of its own and a single line of the form::
+
+    {"command": "compare", "args": {"src": "/a", "target": "/b"}}
+
+It acknowledges the request with ``{"ok": true, "accepted": true}`` right
+away and replies with ``{"ok": true, "result": ...}`` or
+``{"ok": false, "error": "..."}`` once it's done. Results that can get huge,
+such as diffs, are streamed instead: ``{"ok": true, "stream": true}`` is
+followed by one line per item and a final ``null``. CLI commands go through
+`hearth.client` first and only do the work themselves when no daemon is
+listening, or when it doesn't accept the request in time. Once it has, they
+wait for the answer however long the work takes.
+"""
+import json
+import logging
+import os
+import socketserver
+import threading
+from collections.abc import Iterator as IteratorABC
+from dataclasses import dataclass, field
+from os import PathLike, fspath, listdir, stat
+from os.path import relpath
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from hearth import devices as hdevices
+from hearth import rules as hrules
+from hearth import stats as hstats
+from hearth import sync_central
+from hearth.catalog import Catalog, SearchQuery, SearchResult
+from hearth.client import DaemonError, to_json, is_running
+from hearth.dir import data
+from hearth.dir import diff as dirdiff
+from hearth.dir import output as diroutput
+from hearth.dir.sync import CopyOp, sync_plan
+from hearth.watch import Change, Watcher
+
+logger = logging.getLogger(__name__)
+
+_MAX_REQUEST_SIZE = 1 << 20
+# Seconds a request waits for the watcher to journal what it has seen
+_WATCHER_SYNC_TIMEOUT = 5.0
+
+
+@dataclass
+class _CachedDir:
+    dir_: data.Dir
+    mtimes: Dict[str, int] = field(default_factory=dict)
+    watched: bool = False
+    dirty: Dict[str, bool] = field(default_factory=dict)
+    # Rules and prefix of the matcher it was loaded with
+    rules: Optional[Tuple[sync_central.ScanRules, str]] = None
+
+    def is_stale(self) -> bool:
+        try:
+            return any(stat(p).st_mtime_ns != m for p, m in self.mtimes.items())
+        except OSError:
+            return True
+
+    def apply_dirty(self) -> None:
+        """ Relist the directories a watcher reported as changed """
+        for path, recursive in sorted(self.dirty.items(),
+                                      key=lambda kv: kv[0].count(os.sep)):
+            node = self._node(path)
+            if node is None:
+                continue
+
+            try:
+                _relist(node, recursive)
+            except FileNotFoundError:
+                # Its parent is dirty too and has already dropped it
+                continue
+
+        self.dirty.clear()
+
+    def _node(self, path: str) -> Optional[data.Dir]:
+        node: Optional[data.Dir] = self.dir_
+        rel_path = relpath(path, fspath(self.dir_.fullpath))
+        if rel_path == ".":
+            return node
+
+        for part in rel_path.split(os.sep):
+            node = node.subdirs.get(part) if node is not None else None
+
+        return node
+
+
+def _relist(dir_: data.Dir, recursive: bool) -> None:
+    entries = listdir(dir_.fullpath)
+    p = Path(dir_.fullpath)
+
+    dir_.files = {f for f in entries if (p/f).is_file()}
+    dir_.subdirs = {
+        d: dir_.subdirs[d] if d in dir_.subdirs and not recursive else data.loaded_dir(p/d)
+        for d in entries if (p/d).is_dir()
+    }
+
+
+class DaemonState:
+    """ Everything the daemon keeps in memory between requests
+
+    Loaded directory trees are revalidated by stat-ing their directories,
+    which is much cheaper than listing them again. Trees under a watched root
+    skip even that and only relist what the watcher reported, except below
+    directories the watcher ran out of watches for. filecmp's signature
+    cache also stays warm for the daemon's lifetime.
+    """
+
+    def __init__(self, central_path: PathLike, catalog_path: PathLike) -> None:
+        self.central_path = Path(central_path)
+        self.catalog_path = Path(catalog_path)
+        # sqlite connections are bound to their thread, and every request
+        # gets a thread of its own
+        self._local = threading.local()
+        self._central: Optional[sync_central.SyncCentral] = None
+        self._central_mtime = -1
+        self._central_lock = threading.Lock()
+        self._dirs: Dict[str, _CachedDir] = {}
+        self._watched_roots: List[str] = []
+        self._unwatched: Set[str] = set()
+        # Watcher callbacks come in from the watcher's thread
+        self._lock = threading.Lock()
+        # Gets synced with before every request, once trusted
+        self.watcher: Optional[Watcher] = None
+
+        self.handlers: Dict[str, Callable[..., Any]] = {
+            "compare": self.compare_entries,
+            "ping": lambda: "pong",
+            "search": self.search,
+            "stats": self.stats,
+            "sync_plan": self.sync_plan,
+        }
+
+    def close(self) -> None:
+        """ Close the calling thread's catalog connection, if it opened one """
+        catalog = getattr(self._local, "catalog", None)
+        if catalog is not None:
+            catalog.close()
+            self._local.catalog = None
+
+    @property
+    def catalog(self) -> Catalog:
+        catalog = getattr(self._local, "catalog", None)
+        if catalog is None:
+            catalog = self._local.catalog = Catalog(self.catalog_path)
+
+        return catalog
+
+    def central(self, resolve: bool = False) -> sync_central.SyncCentral:
+        """ The sync central, reloaded whenever its file changes
+
+        :param resolve: Point its devices at their current mounts first
+        """
+        with self._central_lock:
+            try:
+                mtime = stat(self.central_path).st_mtime_ns
+            except OSError:
+                raise sync_central.SyncError(f"'{self.central_path}' doesn't exist")
+
+            if self._central is None or mtime != self._central_mtime:
+                self._central = sync_central.get_sync_central(self.central_path)
+                self._central_mtime = mtime
+
+            if resolve and hdevices.resolve_mountpoints(self._central, self.catalog_path):
+                sync_central.save_sync_central(self._central)
+                self._central_mtime = stat(self.central_path).st_mtime_ns
+
+            return self._central
+
+    def watch_started(self, roots: Iterable[str]) -> None:
+        """ Trust the watcher for everything under `roots` from now on """
+        with self._lock:
+            self._watched_roots = list(roots)
+            # Whatever was cached before the watches were in place may be stale
+            self._dirs = {
+                path: cached for path, cached in self._dirs.items()
+                if not self._is_watched(path)
+            }
+
+    def unwatch(self, path: str) -> None:
+        """ Stop trusting the watcher below `path`, which it couldn't watch """
+        with self._lock:
+            self._unwatched.add(path)
+            # Reload them with mtimes to revalidate them by
+            self._dirs = {
+                cached_path: cached for cached_path, cached in self._dirs.items()
+                if not (cached.watched and (_is_under(path, cached_path)
+                                            or _is_under(cached_path, path)))
+            }
+
+    def invalidate(self, changes: List[Change]) -> None:
+        with self._lock:
+            for path, cached in self._dirs.items():
+                for _, changed, recursive in changes:
+                    if _is_under(changed, path):
+                        target = changed
+                    elif _is_under(path, changed):
+                        # A change above the cached tree could've replaced it
+                        target = path
+                    else:
+                        continue
+
+                    cached.dirty[target] = cached.dirty.get(target, False) or recursive
+
+    def loaded_dir(self, path: str, matcher: Optional[hrules.Matcher] = None) -> data.Dir:
+        rules = (matcher.rules, matcher.prefix) if matcher is not None else None
+        with self._lock:
+            cached = self._dirs.get(path)
+            if cached is not None and cached.rules != rules:
+                cached = None
+
+            if cached is not None and cached.watched:
+                cached.apply_dirty()
+            elif cached is None or cached.is_stale():
+                logger.debug("Loading %s into the directory cache", path)
+                # Watcher updates relist without rules, so filtered trees
+                # get revalidated by their mtimes instead
+                watched = self._is_watched(path) and matcher is None
+                mtimes: Dict[str, int] = {}
+                dir_ = data.loaded_dir(Path(path), matcher)
+                if not watched:
+                    data.dir_walk(dir_, lambda d: mtimes.__setitem__(
+                        fspath(d.fullpath), stat(d.fullpath).st_mtime_ns))
+                cached = _CachedDir(dir_, mtimes, watched=watched, rules=rules)
+                self._dirs[path] = cached
+
+            return cached.dir_
+
+    def _is_watched(self, path: str) -> bool:
+        """ Whether the watcher reports every change to the tree at `path` """
+        return (any(_is_under(path, root) for root in self._watched_roots)
+                and not any(_is_under(u, path) or _is_under(path, u)
+                            for u in self._unwatched))
+
+    def _catch_up(self) -> None:
+        """ Apply every change the watcher has seen to the cached trees """
+        if self.watcher is None or not self._watched_roots:
+            return
+
+        if not self.watcher.sync(_WATCHER_SYNC_TIMEOUT):
+            logger.warning("Watcher didn't catch up, reloading watched trees")
+            with self._lock:
+                self._dirs = {path: cached for path, cached in self._dirs.items()
+                              if not cached.watched}
+
+    def matchers(self, *paths: str) -> Sequence[Optional[hrules.Matcher]]:
+        """ Scan rules for the trees at `paths`, if a sync info covers them """
+        try:
+            matchers = hrules.matchers_for(self.central(), *paths)
+        except sync_central.SyncError:
+            matchers = None
+
+        return matchers or [None] * len(paths)
+
+    def compare(self, src: str, target: str) -> dirdiff.DirDiff:
+        src_matcher, target_matcher = self.matchers(src, target)
+        return dirdiff.full_diff_dirs(self.loaded_dir(src, src_matcher),
+                                      self.loaded_dir(target, target_matcher))
+
+    def compare_entries(self,
+                        src: str,
+                        target: str,
+                        statuses: Sequence[str] = diroutput.STATUSES) -> Iterator[diroutput.Entry]:
+        return diroutput.diff_entries(self.compare(src, target), statuses)
+
+    def stats(self, roots: List[str], refresh: bool) -> hstats.Stats:
+        return hstats.gather_stats(self.central(resolve=True),
+                                   self.catalog,
+                                   roots=roots,
+                                   refresh=refresh)
+
+    def search(self, query: Dict[str, Any]) -> List[SearchResult]:
+        return list(self.catalog.search(SearchQuery(**query)))
+
+    def sync_plan(self, master: str, backup: str) -> List[CopyOp]:
+        return sync_plan(master, backup, self.compare(master, backup))
+
+    def dispatch(self, req: Dict[str, Any]) -> Dict[str, Any]:
+        handler = self.handlers.get(req.get("command", ""))
+        if handler is None:
+            return {"ok": False, "error": f"Unknown command {req.get('command')!r}"}
+
+        try:
+            if req["command"] != "ping":
+                self._catch_up()
+            return {"ok": True, "result": handler(**req.get("args", {}))}
+        except Exception as e:
+            logger.exception("Request %s failed", req.get("command"))
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        finally:
+            self.close()
+
+
+def _is_under(path: str, parent: str) -> bool:
+    return path == parent or path.startswith(parent.rstrip(os.sep) + os.sep)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # Streamed results are written a line at a time
+    wbufsize = 64 * 1024
+
+    def handle(self) -> None:
+        line = self.rfile.readline(_MAX_REQUEST_SIZE)
+        try:
+            self._reply(line)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Client hung up before getting its answer")
+
+    def _reply(self, line: bytes) -> None:
+        # Lets the client know the work is underway, however long it takes
+        self.wfile.write(b'{"ok": true, "accepted": true}\n')
+        self.wfile.flush()
+
+        try:
+            req = json.loads(line)
+        except ValueError as e:
+            res = {"ok": False, "error": f"Malformed request: {e}"}
+        else:
+            if req.get("command") == "shutdown":
+                res = {"ok": True, "result": "bye"}
+                # shutdown() blocks until serve_forever returns, so not from here
+                threading.Thread(target=self.server.shutdown).start()
+            else:
+                res = self.server.state.dispatch(req)  # type: ignore
+
+        result = res.get("result")
+        if not isinstance(result, IteratorABC):
+            self.wfile.write(json.dumps(res, default=to_json).encode() + b"\n")
+            return
+
+        self.wfile.write(b'{"ok": true, "stream": true}\n')
+        for item in result:
+            self.wfile.write(json.dumps(item, default=to_json).encode() + b"\n")
+        self.wfile.write(b"null\n")
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Requests in flight don't hold up shutting down
+    daemon_threads = True
+
+    def __init__(self, socket_path: PathLike, state: DaemonState) -> None:
+        self.state = state
+        self.socket_path = Path(socket_path)
+
+        if self.socket_path.exists():
+            if is_running(self.socket_path):
+                raise DaemonError(f"A daemon is already listening on '{socket_path}'")
+            self.socket_path.unlink()
+
+        super().__init__(fspath(self.socket_path), _Handler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+
+
+def serve(socket_path: PathLike,
+          central_path: PathLike,
+          catalog_path: PathLike,
+          watch_roots: Iterable[str] = ()) -> None:
+    """ Serve requests until a shutdown request comes in
+
+    :param watch_roots: Root directories to track changes under while serving
+    """
+    state = DaemonState(central_path, catalog_path)
+    watcher = None
+    if watch_roots:
+        watcher = Watcher(watch_roots, catalog_path,
+                          on_change=state.invalidate,
+                          on_unwatched=state.unwatch)
+        state.watcher = watcher
+        watcher_thread = threading.Thread(target=watcher.run, daemon=True)
+        watcher_thread.start()
+
+    with DaemonServer(socket_path, state) as server:
+        logger.info("hearth daemon listening on '%s'", socket_path)
+        if watcher is not None:
+            threading.Thread(target=_trust_watcher, args=(state, watcher),
+                             daemon=True).start()
+
+        try:
+            server.serve_forever()
+        finally:
+            if watcher is not None:
+                watcher.stop()
+                # Give it a chance to unregister itself from the catalog
+                watcher_thread.join(timeout=2 * watcher.flush_interval)
+
+
+def _trust_watcher(state: DaemonState, watcher: Watcher) -> None:
+    watcher.ready.wait()
+    state.watch_started(watcher.roots)
@@ -0,0 +1,230 @@
+""" Stable identities for storage devices
+
+Device nodes such as /dev/sdb1 change between plug-ins, so devices are
+identified by a marker file hearth writes to their root, falling back to
+the filesystem UUID and label. Every run re-resolves where each known
+device is mounted and moves tracked paths along with it.
+"""
+import logging
+import re
+import uuid
+from os import PathLike, scandir
+from os.path import realpath
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from hearth.sync_central import Device, SyncCentral
+
+logger = logging.getLogger(__name__)
+
+MARKER_FILENAME = ".hearth-device"
+BY_UUID_PATH = Path("/dev/disk/by-uuid")
+BY_LABEL_PATH = Path("/dev/disk/by-label")
+MOUNTS_PATH = Path("/proc/self/mounts")
+FILESYSTEMS_PATH = Path("/proc/filesystems")
+
+
+def device_id(device: Device) -> str:
+    """ Most stable identity known for a device """
+    if device.marker:
+        return f"marker:{device.marker}"
+    if device.uuid:
+        return f"uuid:{device.uuid}"
+    if device.label:
+        return f"label:{device.label}"
+
+    return device.node or device.name
+
+
+def read_marker(mountpoint: Union[str, PathLike]) -> Optional[str]:
+    try:
+        return (Path(mountpoint) / MARKER_FILENAME).read_text().strip() or None
+    except OSError:
+        return None
+
+
+def write_marker(mountpoint: Union[str, PathLike]) -> str:
+    """ Give the device mounted at `mountpoint` a marker, keeping any existing one """
+    marker = read_marker(mountpoint)
+    if marker is None:
+        marker = uuid.uuid4().hex
+        (Path(mountpoint) / MARKER_FILENAME).write_text(marker + "\n")
+
+    return marker
+
+
+def _links(path: Path) -> Dict[str, str]:
+    """ Map device nodes to the (udev-unescaped) names linking to them """
+    try:
+        with scandir(path) as it:
+            return {
+                realpath(e.path): re.sub(r"\\x([0-9a-fA-F]{2})",
+                                         lambda m: chr(int(m.group(1), 16)),
+                                         e.name)
+                for e in it
+            }
+    except OSError:
+        return {}
+
+
+def _unescape_mount(field: str) -> str:
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), field)
+
+
+def mounted_partitions() -> List[Tuple[str, str]]:
+    """ (device, mountpoint) of every mounted physical filesystem
+
+    Reads /proc directly, which is much cheaper than importing psutil for
+    it. Other platforms fall back on psutil.
+    """
+    try:
+        mounts = MOUNTS_PATH.read_text()
+        filesystems = FILESYSTEMS_PATH.read_text()
+    except OSError:
+        import psutil  # type: ignore
+        return [(p.device, p.mountpoint) for p in psutil.disk_partitions()]
+
+    # Same filter as psutil: block-backed filesystems, plus zfs
+    fstypes = set()
+    for line in filesystems.splitlines():
+        fields = line.split()
+        if fields and (fields[0] != "nodev" or fields[-1] == "zfs"):
+            fstypes.add(fields[-1])
+
+    partitions = []
+    for line in mounts.splitlines():
+        fields = line.split()
+        if len(fields) < 3 or fields[2] not in fstypes or fields[0] == "none":
+            continue
+        partitions.append((_unescape_mount(fields[0]), _unescape_mount(fields[1])))
+
+    return partitions
+
+
+def fingerprinted_devices() -> Dict[str, Device]:
+    """ Every mounted partition, keyed by its device identity """
+    uuids = _links(BY_UUID_PATH)
+    labels = _links(BY_LABEL_PATH)
+
+    devices: Dict[str, Device] = {}
+    for dev, mountpoint in mounted_partitions():
+        node = realpath(dev) if dev.startswith("/") else dev
+        device = Device(
+            labels.get(node) or dev,
+            mountpoint,
+            node=dev,
+            uuid=uuids.get(node),
+            label=labels.get(node),
+            marker=read_marker(mountpoint)
+        )
+
+        # Bind mounts share an identity; keep the first mountpoint listed
+        devices.setdefault(device_id(device), device)
+
+    return devices
+
+
+# Identifiers from most to least stable
+_IDENTIFIERS = ("marker", "uuid", "label", "node")
+
+
+def _identifiers(device: Device) -> List[Tuple[str, str]]:
+    """ What a recorded device can be recognized by, in the order to try it
+
+    Only its most stable identifier counts: a device with a UUID whose UUID
+    isn't mounted is unplugged, even if another one took its label or node.
+    """
+    for attr in _IDENTIFIERS:
+        value = getattr(device, attr)
+        if value:
+            return [(attr, value)]
+
+    # Recorded before devices were fingerprinted, when all hearth kept was
+    # the device node, as the name, and the mountpoint
+    return [("node", device.name), ("mountpoint", device.mountpoint)]
+
+
+def _stability(device: Device) -> int:
+    """ Rank of a recorded device's most stable identifier, 0 being the best """
+    return next((i for i, attr in enumerate(_IDENTIFIERS) if getattr(device, attr)),
+                len(_IDENTIFIERS))
+
+
+def _match(device: Device,
+           current: Dict[str, Device],
+           claimed: Set[str]) -> Optional[str]:
+    """ Key in `current` of the partition a recorded device is mounted as
+
+    Partitions another device already matched, and identifiers more than
+    one partition shares, such as a common label, match nothing.
+    """
+    for attr, value in _identifiers(device):
+        found = [key for key, candidate in current.items()
+                 if key not in claimed and getattr(candidate, attr) == value]
+        if len(found) == 1:
+            return found[0]
+
+    return None
+
+
+def resolve_mountpoints(central: SyncCentral,
+                        catalog_path: Optional[PathLike] = None) -> bool:
+    """ Point known devices, and everything tracked on them, at their current mounts
+
+    Sync info sources and indexed catalog roots on a device that moved are
+    rebased onto its new mountpoint, so their indexes survive remounts.
+
+    :returns: Whether the central changed and should be saved
+    """
+    current = fingerprinted_devices()
+
+    # Devices with stabler identifiers get first pick of the partitions
+    matches: Dict[str, Optional[str]] = {}
+    claimed: Set[str] = set()
+    for key, device in sorted(central.devices.items(), key=lambda kv: _stability(kv[1])):
+        found_key = _match(device, current, claimed)
+        matches[key] = found_key
+        if found_key is not None:
+            claimed.add(found_key)
+
+    changed = False
+    moves: Dict[str, str] = {}
+    resolved: Dict[str, Device] = {}
+    for key, device in central.devices.items():
+        found_key = matches[key]
+
+        if found_key is None:
+            changed |= device.mounted
+            device.mounted = False
+        else:
+            found = current[found_key]
+            if found.mountpoint != device.mountpoint:
+                logger.info("Device %s moved from '%s' to '%s'",
+                            key, device.mountpoint, found.mountpoint)
+                moves[device.mountpoint] = found.mountpoint
+
+            found.name = device.name
+            changed |= found != device
+            device = found
+
+        # A device that got a marker since it was recorded is keyed by it now
+        new_key = device_id(device)
+        changed |= new_key != key
+        resolved[new_key] = device
+
+    central.devices = resolved
+
+    if moves:
+        # Only needed when a device moved, which is rare enough to keep
+        # sqlite out of every other run
+        from hearth.catalog import Catalog, rebased_path
+
+        for info in central.sync_infos.values():
+            for name, path in info.sources.items():
+                info.sources[name] = rebased_path(path, moves) or path
+
+        if catalog_path is not None and Path(catalog_path).exists():
+            with Catalog(catalog_path) as catalog:
+                catalog.relocate(moves)
+
+    return changed
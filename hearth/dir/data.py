@@ -4,9 +4,13 @@ import logging
 from dataclasses import dataclass, field
 from functools import total_ordering
 from os import PathLike, listdir
+from os.path import join as ojoin
 from pathlib import Path
 from queue import Queue
-from typing import Callable, Dict, Set
+from typing import Callable, Dict, Optional, Set
+
+from hearth.metrics import metrics
+from hearth.rules import Matcher
 
 logger = logging.getLogger(__name__)
 
@@ -25,13 +29,36 @@ class Dir:
         return self.dirname.__lt__(other.dirname)
 
 
-def loaded_dir(path: PathLike) -> Dir:
-    """ Load directory in the specified path into a Dir object """
+def loaded_dir(path: PathLike, matcher: Optional[Matcher] = None) -> Dir:
+    """ Load directory in the specified path into a Dir object
+
+    :param matcher: Rules leaving entries out; excluded subdirectories
+        aren't listed at all
+    """
+    return _loaded_dir(path, matcher, "")
+
+
+def _loaded_dir(path: PathLike, matcher: Optional[Matcher], rel: str) -> Dir:
     entries = listdir(path=path)
     p = Path(path)
 
-    subdirs = {d: loaded_dir(p/d) for d in entries if (p/d).is_dir()}
-    files =  {f for f in entries if (p/f).is_file()}
+    metrics.count("dirs_listed")
+    # Every entry gets checked for being a directory and then a file
+    metrics.count("stats_issued", 2 * len(entries))
+
+    if matcher is None:
+        subdirs = {d: _loaded_dir(p/d, None, "") for d in entries if (p/d).is_dir()}
+        files = {f for f in entries if (p/f).is_file()}
+    else:
+        matcher = matcher.entering(rel, p, entries)
+        subdirs = {
+            d: _loaded_dir(p/d, matcher, ojoin(rel, d)) for d in entries
+            if (p/d).is_dir() and not matcher.skips_dir(ojoin(rel, d))
+        }
+        files = {
+            f for f in entries
+            if (p/f).is_file() and not matcher.skips_file(ojoin(rel, f), (p/f).stat)
+        }
 
     return Dir(p.name, path, files=files, subdirs=subdirs)
 
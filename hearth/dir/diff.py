@@ -5,13 +5,14 @@ from copy import copy
 from dataclasses import dataclass, field
 from filecmp import cmpfiles
 from os import listdir
-from os.path import basename, isdir, isfile
+from os.path import basename, getsize, isdir, isfile
 from os.path import join as ojoin
 from pathlib import Path
 from queue import Queue
 from typing import Dict, Generator, Iterable, List, Set
 
 from hearth.dir.data import Dir
+from hearth.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -61,8 +62,8 @@ class SubdirDiff:
 
 @dataclass
 class DirDiff:
-    files: FilesDiff = FilesDiff()
-    subdirs: SubdirDiff = SubdirDiff()
+    files: FilesDiff = field(default_factory=FilesDiff)
+    subdirs: SubdirDiff = field(default_factory=SubdirDiff)
 
     def __or__(self, other) -> DirDiff:
         self.files |= other.files
@@ -92,6 +93,12 @@ def _compare_files(src_dir: Dir,
                                       files_in_both,
                                       shallow=False)
 
+    metrics.count("files_compared", len(files_in_both))
+    metrics.count("stats_issued", 2 * len(files_in_both))
+    if metrics.enabled:
+        metrics.count("bytes_compared",
+                      _compared_bytes(src_dir, cmp_dir, matches + mismatches))
+
     return FilesDiff(
         changed=_prepend_path(mismatches, prefix_path),
         missing=_prepend_path(src_dir.files - files_in_both, prefix_path),
@@ -100,6 +107,28 @@ def _compare_files(src_dir: Dir,
     )
 
 
+def _compared_bytes(src_dir: Dir,
+                    cmp_dir: Dir,
+                    files: Iterable[str]) -> int:
+    """ Upper bound of bytes read to compare files
+
+    Files of different sizes are told apart without reading them, and
+    changed files only get read up to their first difference.
+    """
+    total = 0
+    for f in files:
+        try:
+            src_size = getsize(ojoin(src_dir.fullpath, f))
+            cmp_size = getsize(ojoin(cmp_dir.fullpath, f))
+        except OSError:
+            continue
+
+        if src_size == cmp_size:
+            total += src_size + cmp_size
+
+    return total
+
+
 def _compare_subdirs(src_dir: Dir,
                      cmp_dir: Dir,
                      prefix_path: str = "") -> SubdirDiff:
@@ -0,0 +1,158 @@
+""" Streamed renderings of a DirDiff
+
+Every format consumes the diff's entries one at a time and writes them out
+as it goes, so printing a diff never builds a second copy of it. The
+entries can come straight from a daemon, too, without the diff ever being
+rebuilt here. Paths come out in no particular order unless sorting is asked
+for, which holds on to one status and type's worth of entries at a time.
+"""
+import json
+import logging
+from itertools import groupby
+from os import PathLike, stat, walk
+from os.path import join as ojoin
+from typing import Callable, Dict, Iterable, Iterator, Sequence, TextIO, Tuple, Union
+
+from hearth.dir.diff import DirDiff
+
+logger = logging.getLogger(__name__)
+
+# (type, status, path)
+Entry = Tuple[str, str, str]
+
+STATUSES = ("changed", "missing", "new", "shared")
+DEFAULT_STATUSES = ("changed", "missing", "new")
+
+
+class OutputError(Exception):
+    pass
+
+
+def diff_entries(diff: DirDiff,
+                 statuses: Iterable[str] = DEFAULT_STATUSES) -> Iterator[Entry]:
+    """ (type, status, path) of every entry with one of `statuses`
+
+    Entries come grouped by status, in the order of `statuses`, then by
+    type. Subdirectories are never "changed"; their differences show up as
+    entries below them.
+    """
+    for status in statuses:
+        for path in getattr(diff.files, status):
+            yield "file", status, path
+        for path in getattr(diff.subdirs, status, ()):
+            yield "dir", status, path
+
+
+def sorted_entries(entries: Iterable[Entry]) -> Iterator[Entry]:
+    """ Entries with their paths sorted within each run of one status and type
+
+    Every run gets copied into a list to be sorted, so this costs memory in
+    proportion to the largest one.
+    """
+    for (entry_type, status), group in groupby(entries, key=lambda e: e[:2]):
+        for path in sorted(path for _, _, path in group):
+            yield entry_type, status, path
+
+
+def write_text(entries: Iterable[Entry], out: TextIO, **_) -> None:
+    """ One line per entry """
+    for entry_type, status, path in entries:
+        out.write(f"{status:<8} {entry_type:<4} {path}\n")
+
+
+def write_jsonl(entries: Iterable[Entry], out: TextIO, **_) -> None:
+    """ One JSON object per entry """
+    for entry_type, status, path in entries:
+        out.write(json.dumps({"type": entry_type, "status": status, "path": path}))
+        out.write("\n")
+
+
+def write_null(entries: Iterable[Entry], out: TextIO, **_) -> None:
+    """ Paths terminated by NUL, for `xargs -0` and friends """
+    for entry in entries:
+        out.write(entry[2])
+        out.write("\0")
+
+
+def _size(path: str) -> int:
+    try:
+        return stat(path).st_size
+    except OSError as e:
+        logger.warning("Could not size '%s': %s", path, e)
+        return 0
+
+
+def _tree_size(path: str) -> int:
+    return sum(_size(ojoin(dirpath, f))
+               for dirpath, _, filenames in walk(path)
+               for f in filenames)
+
+
+def write_summary(entries: Iterable[Entry],
+                  out: TextIO,
+                  statuses: Sequence[str],
+                  src: Union[str, PathLike],
+                  target: Union[str, PathLike]) -> None:
+    """ Entry counts and byte totals per type and status, as one JSON object
+
+    New entries are sized in the target and everything else in the source,
+    so missing and changed bytes add up to what a sync would copy.
+    """
+    summary: Dict[str, Dict[str, Dict[str, int]]] = {
+        "files": {s: {"count": 0, "bytes": 0} for s in statuses},
+        "subdirs": {s: {"count": 0, "bytes": 0} for s in statuses if s != "changed"},
+    }
+    for entry_type, status, path in entries:
+        root = target if status == "new" else src
+        totals = summary["files" if entry_type == "file" else "subdirs"][status]
+        totals["count"] += 1
+        full_path = ojoin(root, path)
+        totals["bytes"] += _size(full_path) if entry_type == "file" else _tree_size(full_path)
+
+    json.dump(summary, out, indent=2)
+    out.write("\n")
+
+
+FORMATS: Dict[str, Callable[..., None]] = {
+    "text": write_text,
+    "jsonl": write_jsonl,
+    "null": write_null,
+    "summary": write_summary,
+}
+
+
+def write_entries(entries: Iterable[Entry],
+                  out: TextIO,
+                  fmt: str = "text",
+                  statuses: Sequence[str] = DEFAULT_STATUSES,
+                  src: Union[str, PathLike] = "",
+                  target: Union[str, PathLike] = "",
+                  sort: bool = False) -> None:
+    """ Write a diff's entries, in the order `diff_entries` yields them, in one of `FORMATS`
+
+    :param statuses: Statuses `entries` were picked by
+    :param src: Root the diff's paths are relative to on the source side
+    :param target: Same for the target side; both are only used to size entries
+    :param sort: Sort paths within each status and type, see `sorted_entries`
+    """
+    if fmt not in FORMATS:
+        raise OutputError(f"Unknown output format '{fmt}'")
+    unknown = set(statuses) - set(STATUSES)
+    if unknown:
+        raise OutputError(f"Unknown statuses {sorted(unknown)}")
+
+    if sort:
+        entries = sorted_entries(entries)
+
+    FORMATS[fmt](entries, out, statuses=statuses, src=src, target=target)
+
+
+def write_diff(diff: DirDiff,
+               out: TextIO,
+               fmt: str = "text",
+               statuses: Sequence[str] = DEFAULT_STATUSES,
+               src: Union[str, PathLike] = "",
+               target: Union[str, PathLike] = "",
+               sort: bool = False) -> None:
+    """ Write the entries of a diff with one of `statuses`, as `write_entries` does """
+    write_entries(diff_entries(diff, statuses), out, fmt, statuses, src, target, sort)
@@ -0,0 +1,272 @@
+""" Concurrent scan, compare and copy for high-latency storage
+
+Walking both trees, comparing the files they share and copying what the
+backup lacks run as asyncio stages connected by queues. Every blocking
+call goes to a thread pool, so on network mounts many listings, reads and
+transfers are in flight at once instead of one round trip at a time.
+
+The queues into the compare and copy stages are bounded. A walk that runs
+ahead of slow comparisons or copies waits for them instead of piling up
+work in memory.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from filecmp import cmp
+from os import PathLike, fspath, scandir, stat
+from os.path import join as ojoin
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from hearth.dir.diff import DirDiff, FilesDiff, SubdirDiff
+from hearth.dir.sync import CopyOp, apply_copy
+from hearth.metrics import metrics
+from hearth.rules import Matcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS = 8
+# Work queued per worker before the stage feeding it has to wait
+_QUEUE_DEPTH = 4
+# Shared files handed to the compare stage at a time, so small files don't
+# each pay for a trip through the queue and the executor
+_COMPARE_BATCH = 16
+
+
+def _listing(path: str,
+             rel: str,
+             matcher: Optional[Matcher]) -> Tuple[Set[str], Set[str], Optional[Matcher]]:
+    """ Files and subdirectories directly under `path` that `matcher` keeps
+
+    :returns: Files, subdirectories and the matcher for the subdirectories
+    """
+    with scandir(path) as it:
+        entries = list(it)
+
+    if matcher is not None:
+        matcher = matcher.entering(rel, path, [e.name for e in entries])
+
+    files = set()
+    subdirs = set()
+    for entry in entries:
+        if entry.is_dir():
+            if matcher is None or not matcher.skips_dir(ojoin(rel, entry.name)):
+                subdirs.add(entry.name)
+        elif entry.is_file():
+            if matcher is None or not matcher.skips_file(ojoin(rel, entry.name), entry.stat):
+                files.add(entry.name)
+
+    return files, subdirs, matcher
+
+
+def _compare_files(master: str,
+                   backup: str,
+                   files: List[str]) -> Tuple[List[str], List[str], int]:
+    """ Split files into same and changed ones, like `filecmp.cmpfiles`
+
+    Files that can't be read are left out and logged.
+
+    :returns: Same files, changed files and at most how many bytes were read
+    """
+    same: List[str] = []
+    changed: List[str] = []
+    num_bytes = 0
+    for f in files:
+        src = ojoin(master, f)
+        dst = ojoin(backup, f)
+        try:
+            src_size = stat(src).st_size
+            dst_size = stat(dst).st_size
+            (same if cmp(src, dst, shallow=False) else changed).append(f)
+        except OSError as e:
+            logger.warning("Could not compare '%s': %s", f, e)
+            continue
+
+        if src_size == dst_size:
+            num_bytes += src_size + dst_size
+
+    return same, changed, num_bytes
+
+
+class _Pipeline:
+    def __init__(self,
+                 master: PathLike,
+                 backup: PathLike,
+                 jobs: int,
+                 commit: bool,
+                 on_copy: Optional[Callable[[CopyOp], None]],
+                 matchers: Optional[Sequence[Matcher]]) -> None:
+        self.master = fspath(master)
+        self.backup = fspath(backup)
+        self.jobs = max(1, jobs)
+        self.commit = commit
+        self.on_copy = on_copy
+        self.matchers = tuple(matchers) if matchers else (None, None)
+
+        # Per directory, relative to both roots, until they get folded
+        self.diffs: Dict[str, DirDiff] = {}
+        self.copied: List[CopyOp] = []
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    async def run(self) -> DirDiff:
+        with ThreadPoolExecutor(self.jobs, thread_name_prefix="hearth-io") as self.executor:
+            # The walk queue stays unbounded since walkers feed it themselves
+            self.to_walk: asyncio.Queue = asyncio.Queue()
+            self.to_compare: asyncio.Queue = asyncio.Queue(self.jobs * _QUEUE_DEPTH)
+            self.to_copy: asyncio.Queue = asyncio.Queue(self.jobs * _QUEUE_DEPTH)
+
+            stages: List[Tuple[asyncio.Queue, Callable[..., Awaitable[None]]]] = [
+                (self.to_walk, self._walk),
+                (self.to_compare, self._compare),
+            ]
+            if self.commit:
+                stages.append((self.to_copy, self._copy))
+
+            workers = [asyncio.ensure_future(self._worker(queue, handler))
+                       for queue, handler in stages
+                       for _ in range(self.jobs)]
+
+            self.to_walk.put_nowait(("", *self.matchers))
+            drained = asyncio.ensure_future(self._drain([q for q, _ in stages]))
+
+            # Workers only ever stop by failing
+            await asyncio.wait([drained, *workers], return_when=asyncio.FIRST_COMPLETED)
+
+            drained.cancel()
+            for w in workers:
+                w.cancel()
+            results = await asyncio.gather(drained, *workers, return_exceptions=True)
+
+        for r in results:
+            # Cancellations aren't Exceptions, so this is the first failure
+            if isinstance(r, Exception):
+                raise r
+
+        return self._folded("")
+
+    def _blocking(self, func: Callable, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    @staticmethod
+    async def _drain(queues: List[asyncio.Queue]) -> None:
+        # Earlier stages feed later ones, so drain them in order
+        for queue in queues:
+            await queue.join()
+
+    @staticmethod
+    async def _worker(queue: asyncio.Queue, handler: Callable) -> None:
+        while True:
+            item = await queue.get()
+            try:
+                await handler(item)
+            finally:
+                queue.task_done()
+
+    async def _walk(self, item: Tuple[str, Optional[Matcher], Optional[Matcher]]) -> None:
+        rel, src_matcher, dst_matcher = item
+        (src_files, src_subdirs, src_matcher), (dst_files, dst_subdirs, dst_matcher) = \
+            await asyncio.gather(
+                self._blocking(_listing, ojoin(self.master, rel), rel, src_matcher),
+                self._blocking(_listing, ojoin(self.backup, rel), rel, dst_matcher),
+            )
+        metrics.count("dirs_listed", 2)
+
+        diff = DirDiff(
+            files=FilesDiff(
+                missing={ojoin(rel, f) for f in src_files - dst_files},
+                new={ojoin(rel, f) for f in dst_files - src_files},
+            ),
+            subdirs=SubdirDiff(
+                missing={ojoin(rel, d) for d in src_subdirs - dst_subdirs},
+                new={ojoin(rel, d) for d in dst_subdirs - src_subdirs},
+                shared={ojoin(rel, d) for d in src_subdirs & dst_subdirs},
+            )
+        )
+        self.diffs[rel] = diff
+
+        for subdir in diff.subdirs.shared:
+            self.to_walk.put_nowait((subdir, src_matcher, dst_matcher))
+        for path in sorted(diff.files.missing | diff.subdirs.missing):
+            await self._plan_copy(path, path in diff.subdirs.missing)
+        shared = sorted(ojoin(rel, f) for f in src_files & dst_files)
+        for i in range(0, len(shared), _COMPARE_BATCH):
+            await self.to_compare.put((rel, shared[i:i + _COMPARE_BATCH]))
+
+    async def _compare(self, batch: Tuple[str, List[str]]) -> None:
+        rel, files = batch
+        same, changed, num_bytes = await self._blocking(_compare_files,
+                                                        self.master,
+                                                        self.backup,
+                                                        files)
+        metrics.count("files_compared", len(files))
+        metrics.count("bytes_compared", num_bytes)
+
+        diff = self.diffs[rel]
+        diff.files.shared.update(same)
+        diff.files.changed.update(changed)
+        for f in changed:
+            await self._plan_copy(f, False)
+
+    async def _plan_copy(self, rel: str, is_dir: bool) -> None:
+        if self.commit:
+            await self.to_copy.put(CopyOp(ojoin(self.master, rel),
+                                          ojoin(self.backup, rel),
+                                          is_dir))
+
+    async def _copy(self, op: CopyOp) -> None:
+        src_matcher = self.matchers[0]
+        ignore = src_matcher.copy_ignore(self.master) if src_matcher is not None else None
+        await self._blocking(apply_copy, op, ignore)
+        self.copied.append(op)
+        if self.on_copy is not None:
+            self.on_copy(op)
+
+    def _folded(self, rel: str) -> DirDiff:
+        """ Merge per-directory diffs the way `full_diff_dirs` does
+
+        Shared subdirectories without any differences below them are kept
+        as shared; everything else is merged into their parent's diff.
+        """
+        diff = self.diffs[rel]
+        subdirs = diff.subdirs.shared
+        diff.subdirs.shared = set()
+
+        for subdir in subdirs:
+            subdir_diff = self._folded(subdir)
+            if subdir_diff:
+                diff |= subdir_diff
+            else:
+                diff.subdirs.shared.add(subdir)
+
+        return diff
+
+
+def pipelined_diff(master: PathLike,
+                   backup: PathLike,
+                   jobs: int = DEFAULT_JOBS,
+                   matchers: Optional[Sequence[Matcher]] = None) -> DirDiff:
+    """ Same diff as `full_diff_dirs` over freshly loaded dirs, with `jobs` I/O calls in flight
+
+    :param matchers: Rules for the master and the backup side, as for `loaded_dir`
+    """
+    return asyncio.run(_Pipeline(master, backup, jobs, False, None, matchers).run())
+
+
+def pipelined_sync(master: PathLike,
+                   backup: PathLike,
+                   jobs: int = DEFAULT_JOBS,
+                   on_copy: Optional[Callable[[CopyOp], None]] = None,
+                   matchers: Optional[Sequence[Matcher]] = None) -> Tuple[DirDiff, List[CopyOp]]:
+    """ Copy what the backup lacks while the trees are still being compared
+
+    Copies the same operations `sync_plan` would plan for the diff.
+
+    :param on_copy: Called in the event loop after every finished copy
+    :param matchers: Rules for the master and the backup side, as for `loaded_dir`
+    :returns: Diff of master against the backup as it was, and the copies made
+    """
+    pipeline = _Pipeline(master, backup, jobs, True, on_copy, matchers)
+    diff = asyncio.run(pipeline.run())
+
+    return diff, pipeline.copied
@@ -0,0 +1,69 @@
+import logging
+import shutil
+import time
+from dataclasses import dataclass
+from os import PathLike, fspath, walk
+from os.path import getsize, isdir
+from os.path import join as ojoin
+from typing import Callable, List, Optional, Set, Tuple, Union
+
+from hearth.dir.diff import DirDiff
+from hearth.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CopyOp:
+    src: str
+    dst: str
+    is_dir: bool
+
+
+def sync_plan(master: Union[str, PathLike],
+              backup: Union[str, PathLike],
+              diff: DirDiff) -> List[CopyOp]:
+    """ Copies needed to bring a backup up to date with its master
+
+    :param master: Path of the master directory
+    :param backup: Path of the backup directory
+    :param diff: Diff of master against backup, relative to both roots
+    """
+    contents_to_copy = diff.files.changed | diff.files.missing | diff.subdirs.missing
+
+    ops = []
+    for rel_path in sorted(contents_to_copy):
+        src = ojoin(fspath(master), rel_path)
+        ops.append(CopyOp(src, ojoin(fspath(backup), rel_path), isdir(src)))
+
+    return ops
+
+
+def apply_copy(op: CopyOp,
+               ignore: Optional[Callable[[str, List[str]], Set[str]]] = None) -> None:
+    """ Carry out a copy
+
+    :param ignore: Passed on to shutil.copytree when copying a directory
+    """
+    start = time.perf_counter()
+    if op.is_dir:
+        shutil.copytree(op.src, op.dst, ignore=ignore)
+    else:
+        shutil.copy(op.src, op.dst)
+    elapsed = time.perf_counter() - start
+
+    if metrics.enabled:
+        num_files, num_bytes = _tree_size(op.dst) if op.is_dir else (1, getsize(op.dst))
+        metrics.count("files_copied", num_files)
+        metrics.count("bytes_copied", num_bytes)
+        metrics.transfer(op.dst, num_bytes, elapsed)
+
+
+def _tree_size(path: str) -> Tuple[int, int]:
+    num_files = 0
+    num_bytes = 0
+    for dirpath, _, filenames in walk(path):
+        num_files += len(filenames)
+        num_bytes += sum(getsize(ojoin(dirpath, f)) for f in filenames)
+
+    return num_files, num_bytes
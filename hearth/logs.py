@@ -0,0 +1,53 @@
+import logging
+import sys
+from typing import Any, Dict, Optional
+
+TEXT_FORMAT = "%(asctime)s - %(message)s"
+
+LEVELS: Dict[str, Optional[int]] = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "off": None,
+}
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """ One JSON object per record, including any `extra` fields """
+
+    def format(self, record: logging.LogRecord) -> str:
+        # Deferred since most runs log plain text
+        import json
+
+        payload: Dict[str, Any] = {
+            "ts": record.created,
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        payload.update(
+            (k, v) for k, v in vars(record).items() if k not in _RECORD_ATTRS
+        )
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+
+        return json.dumps(payload, default=str)
+
+
+def configure_logging(level: str = "info", fmt: str = "text") -> None:
+    """ Set up hearth's logging; an "off" level disables it altogether """
+    log_level = LEVELS[level]
+    if log_level is None:
+        logging.disable(logging.CRITICAL)
+        return
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    root_logger = logging.getLogger()
+    root_logger.handlers[:] = [handler]
+    root_logger.setLevel(log_level)
@@ -1,32 +1,121 @@
+# hearth gets run from scripts and cron a lot, so this module only imports
+# what every command needs. Anything heavier is imported by the commands
+# that use it.
 import logging
-import pprint
-import shutil
-import sys
-from dataclasses import asdict
-from datetime import datetime
-from os import curdir, fspath, path
+import time
 from pathlib import Path
+from typing import List
 
 import click
-import psutil  # type: ignore
 
-from hearth import sync_central
-from hearth.dir import data
-from hearth.dir import diff as dirdiff
+from hearth import logs
 
-pp: pprint.PrettyPrinter = pprint.PrettyPrinter(indent=4)
 DEFAULT_SAVE_FILENAME = ".hearth-central.toml"
 DEFAULT_SAVE_PATH: Path = Path.home() / DEFAULT_SAVE_FILENAME
+DEFAULT_CATALOG_FILENAME = ".hearth-catalog.db"
+DEFAULT_CATALOG_PATH: Path = Path.home() / DEFAULT_CATALOG_FILENAME
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(stream=sys.stdout,
-                    level=logging.DEBUG,
-                    format="%(asctime)s - %(message)s")
+
+
+def _pprint(obj) -> None:
+    import pprint
+    pprint.PrettyPrinter(indent=4).pprint(obj)
+
+
+def _load_central():
+    """ Load the sync central with its devices resolved to their current mounts """
+    from hearth import devices as hdevices
+    from hearth import sync_central
+
+    central = sync_central.get_sync_central(DEFAULT_SAVE_PATH)
+    if hdevices.resolve_mountpoints(central, DEFAULT_CATALOG_PATH):
+        sync_central.save_sync_central(central)
+
+    return central
+
+
+def _matchers(*paths: str) -> List:
+    """ Scan rules of the sync info covering `paths`, or None for each without one """
+    from hearth import sync_central
+    from hearth.rules import matchers_for
+
+    try:
+        matchers = matchers_for(_load_central(), *paths)
+    except sync_central.SyncError:
+        matchers = None
+
+    return matchers or [None] * len(paths)
+
+
+def _log_copy(verb: str, op) -> None:
+    content_type = "directory" if op.is_dir else "file"
+    logger.info("%s %s %s >>>> %s", verb, content_type, op.src, op.dst)
+
+
+def _write_report(report_path: str, command: str, start: float) -> None:
+    import json
+    import tracemalloc
+
+    from hearth.metrics import metrics
+
+    report = {"command": command, "seconds": time.perf_counter() - start}
+    report.update(metrics.report())
+
+    if tracemalloc.is_tracing():
+        _, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+        report["tracemalloc"] = {
+            "peak_bytes": peak,
+            "top": [{"where": str(s.traceback), "bytes": s.size} for s in top],
+        }
+        tracemalloc.stop()
+
+    if report_path == "-":
+        click.echo(json.dumps(report, indent=2), err=True)
+    else:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
 
 
 @click.group()
-def root():
-    pass
+@click.option("--log-level", type=click.Choice(list(logs.LEVELS)),
+              default="info", show_default=True)
+@click.option("--log-format", type=click.Choice(["text", "json"]),
+              default="text", show_default=True)
+@click.option("--metrics", "metrics_path", type=click.Path(dir_okay=False, allow_dash=True),
+              help="Write phase timings and counters as JSON ('-' for stderr)")
+@click.option("--profile", "profile_path", type=click.Path(dir_okay=False),
+              help="Write a cProfile dump of the command")
+@click.option("--tracemalloc", "trace_memory", is_flag=True,
+              help="Add peak memory and top allocations to the metrics")
+@click.pass_context
+def root(ctx, log_level, log_format, metrics_path, profile_path, trace_memory):
+    logs.configure_logging(log_level, log_format)
+
+    if trace_memory:
+        import tracemalloc
+        metrics_path = metrics_path or "-"
+        tracemalloc.start()
+
+    if metrics_path:
+        from hearth.metrics import metrics
+        start = time.perf_counter()
+        metrics.enable()
+        ctx.call_on_close(lambda: _write_report(metrics_path,
+                                                ctx.invoked_subcommand,
+                                                start))
+
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def dump_profile():
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+
+        ctx.call_on_close(dump_profile)
 
 
 @click.command(
@@ -35,12 +124,50 @@ def root():
 )
 @click.argument("src")
 @click.argument("target")
-def compare_cmd(src, target):
-    src_dir = data.loaded_dir(src)
-    target_dir = data.loaded_dir(target)
-    res = dirdiff.full_diff_dirs(src_dir, target_dir)
+@click.option("-j", "--jobs", type=click.IntRange(min=1), default=1, show_default=True,
+              help="Directory listings and file reads to keep in flight")
+# Choices mirror hearth.dir.output, which is only imported once the command runs
+@click.option("--format", "fmt", type=click.Choice(["text", "jsonl", "null", "summary"]),
+              default="text", show_default=True,
+              help="Lines, JSON Lines, NUL-terminated paths or counts and byte totals")
+@click.option("--status", "statuses", multiple=True,
+              type=click.Choice(["changed", "missing", "new", "shared"]),
+              help="Entries to output (default: changed, missing and new)")
+@click.option("--sort", is_flag=True,
+              help="Sort paths within each status and type, which holds them in memory")
+@click.option("-o", "--output", type=click.Path(dir_okay=False, allow_dash=True),
+              default="-", show_default=True)
+def compare_cmd(src, target, jobs, fmt, statuses, sort, output):
+    from hearth import client
+    from hearth.dir import data
+    from hearth.dir import diff as dirdiff
+    from hearth.dir.output import DEFAULT_STATUSES, diff_entries, write_entries
+    from hearth.metrics import metrics
+
+    statuses = statuses or DEFAULT_STATUSES
+    # A daemon streams entries over as they get written, so the diff is
+    # never held in this process
+    with metrics.phase("daemon"):
+        entries = client.remote_diff_entries(src, target, statuses)
 
-    pp.pprint(asdict(res))
+    if entries is None and jobs > 1:
+        from hearth.dir.pipeline import pipelined_diff
+        with metrics.phase("pipeline"):
+            res = pipelined_diff(src, target, jobs, _matchers(src, target))
+        entries = diff_entries(res, statuses)
+    elif entries is None:
+        src_matcher, target_matcher = _matchers(src, target)
+        with metrics.phase("scan"):
+            src_dir = data.loaded_dir(src, src_matcher)
+            target_dir = data.loaded_dir(target, target_matcher)
+        with metrics.phase("compare"):
+            res = dirdiff.full_diff_dirs(src_dir, target_dir)
+        entries = diff_entries(res, statuses)
+
+    # Undecodable file names get written back out as the bytes they were
+    with metrics.phase("output"), \
+            click.open_file(output, "w", errors="surrogateescape") as out:
+        write_entries(entries, out, fmt, statuses, src, target, sort)
 
 
 @click.command(
@@ -48,10 +175,12 @@ def compare_cmd(src, target):
     short_help="Initialize hearth on the current system"
 )
 def init_cmd():
-    devices = {
-        p.device: sync_central.Device(p.device, p.mountpoint)
-        for p in psutil.disk_partitions()
-    }
+    from datetime import datetime
+
+    from hearth import devices as hdevices
+    from hearth import sync_central
+
+    devices = hdevices.fingerprinted_devices()
 
     now = datetime.now()
     central = sync_central.SyncCentral(
@@ -66,6 +195,24 @@ def init_cmd():
     logger.info(f"Initialized hearth into '{DEFAULT_SAVE_PATH}'")
 
 
+@click.command(
+    name="mark",
+    short_help="Write a marker identifying the device mounted somewhere"
+)
+@click.argument("mountpoint")
+def mark_cmd(mountpoint):
+    from hearth import devices as hdevices
+    from hearth import sync_central
+
+    marker = hdevices.write_marker(mountpoint)
+    logger.info("Device at '%s' is marked as %s", mountpoint, marker)
+
+    try:
+        _load_central()
+    except sync_central.SyncError:
+        pass
+
+
 # Roadmap for list:
 # Create a centralized YAML to store this (for now)
 #	- Not sure if we need a more persistent store but this should be enough
@@ -85,11 +232,13 @@ def init_cmd():
     short_help="List the storage devices and save points in a system"
 )
 def list_cmd():
+    from hearth import sync_central
+
     try:
-        central = sync_central.get_sync_central(DEFAULT_SAVE_PATH)
+        central = _load_central()
 
         # TODO: Print better than this
-        pp.pprint(central)
+        _pprint(central)
     except sync_central.SyncError:
         logger.info("Current system is uninitialized."
                     " Could not retrieve any save points or system details."
@@ -97,6 +246,105 @@ def list_cmd():
         return
 
 
+@click.command(
+    name="stats",
+    short_help="Show capacity per device and size per root directory"
+)
+@click.argument("roots", nargs=-1)
+@click.option("--refresh", is_flag=True,
+              help="Rescan directories that changed since the last scan")
+def stats_cmd(roots, refresh):
+    from hearth import client
+    from hearth import stats as hstats
+    from hearth import sync_central
+    from hearth.catalog import Catalog
+    from hearth.metrics import metrics
+
+    if not DEFAULT_SAVE_PATH.exists():
+        logger.info("Current system is uninitialized."
+                    " Please run 'hearth init' to initialize first.")
+        return
+
+    # A running daemon resolves devices itself, so this process only
+    # reads the central when it has to do the work
+    with metrics.phase("daemon"):
+        res = client.remote_stats(list(roots), refresh)
+
+    if res is None:
+        try:
+            central = _load_central()
+        except sync_central.SyncError:
+            logger.info("Current system is uninitialized."
+                        " Please run 'hearth init' to initialize first.")
+            return
+
+        with metrics.phase("stats"), Catalog(DEFAULT_CATALOG_PATH) as catalog:
+            res = hstats.gather_stats(central, catalog, roots=roots, refresh=refresh)
+
+    click.echo("Devices:")
+    for d in res.devices:
+        click.echo(f"  {d.name} ({d.mountpoint}): "
+                   f"{d.used}/{d.total} bytes used, {d.free} bytes free")
+    click.echo(f"Total: {res.total_used}/{res.total_capacity} bytes used")
+
+    click.echo("Root directories:")
+    for root, summary in res.roots.items():
+        if summary is None:
+            click.echo(f"  {root}: not indexed (run with --refresh)")
+        else:
+            click.echo(f"  {root}: {summary.total_size} bytes"
+                       f" in {summary.total_files} files"
+                       f" (scanned {summary.last_scanned:%Y-%m-%d %H:%M})")
+
+
+@click.command(
+    name="search",
+    short_help="Search indexed devices for files and directories"
+)
+@click.argument("pattern", required=False)
+@click.option("--min-size", type=int, help="Minimum size in bytes")
+@click.option("--max-size", type=int, help="Maximum size in bytes")
+@click.option("--newer-than", type=click.DateTime(),
+              help="Only entries modified at or after this time")
+@click.option("--older-than", type=click.DateTime(),
+              help="Only entries modified before this time")
+@click.option("--type", "entry_type", type=click.Choice(["file", "dir"]),
+              help="Only match files or directories")
+@click.option("--root", "roots", multiple=True,
+              help="Only search under this root directory")
+@click.option("--limit", type=int, default=1000, show_default=True,
+              help="Maximum number of results")
+def search_cmd(pattern, min_size, max_size, newer_than, older_than,
+               entry_type, roots, limit):
+    from hearth import client
+    from hearth.catalog import Catalog, SearchQuery
+    from hearth.metrics import metrics
+
+    # Anything with glob characters is a glob, otherwise it's a substring
+    is_glob = pattern is not None and any(c in pattern for c in "*?[")
+    query = SearchQuery(
+        glob=pattern if is_glob else None,
+        substring=None if is_glob else pattern,
+        min_size=min_size,
+        max_size=max_size,
+        newer_than=newer_than.timestamp() if newer_than else None,
+        older_than=older_than.timestamp() if older_than else None,
+        is_dir=None if entry_type is None else entry_type == "dir",
+        roots=list(roots),
+        limit=limit
+    )
+
+    with metrics.phase("daemon"):
+        results = client.remote_search(query)
+
+    if results is None:
+        with metrics.phase("search"), Catalog(DEFAULT_CATALOG_PATH) as catalog:
+            results = list(catalog.search(query))
+
+    for res in results:
+        click.echo(res.fullpath + ("/" if res.is_dir else ""))
+
+
 # TODO: Implement a sync
 #
 # Might need to share the code from Compare
@@ -120,11 +368,14 @@ def list_cmd():
 @click.argument("master")
 @click.argument("backup")
 @click.option("--no-commit", is_flag=True, help="Do not commit sync")
-def sync_cmd(master, backup, no_commit):
-    master_dir = data.loaded_dir(master)
-    backup_dir = data.loaded_dir(backup)
-
-    diff = dirdiff.full_diff_dirs(master_dir, backup_dir, full_paths=True)
+@click.option("-j", "--jobs", type=click.IntRange(min=1), default=1, show_default=True,
+              help="Directory listings, file reads and copies to keep in flight")
+def sync_cmd(master, backup, no_commit, jobs):
+    from hearth import client
+    from hearth.dir import data
+    from hearth.dir import diff as dirdiff
+    from hearth.dir.sync import apply_copy, sync_plan
+    from hearth.metrics import metrics
 
     logger.info("Setting master directory to %s", master)
     logger.info("Setting backup directory to %s", backup)
@@ -132,36 +383,136 @@ def sync_cmd(master, backup, no_commit):
     if no_commit:
         logger.info("No-commit enabled. No changes will be committed!")
 
-    contents_to_copy = diff.files.changed | diff.files.missing | diff.subdirs.missing
-    for f in contents_to_copy:
-        master_copy = Path(f)
-        backup_copy = Path(backup) / master_copy.name
+    matchers = _matchers(master, backup)
+    master_matcher, backup_matcher = matchers
+    # Directories get copied whole, so rules have to apply to their copies too
+    ignore = master_matcher.copy_ignore(master) if master_matcher is not None else None
+
+    with metrics.phase("daemon"):
+        plan = client.remote_sync_plan(master, backup)
+
+    if plan is None and jobs > 1:
+        from hearth.dir.pipeline import pipelined_diff, pipelined_sync
+
+        with metrics.phase("pipeline"):
+            if no_commit:
+                plan = sync_plan(master, backup,
+                                 pipelined_diff(master, backup, jobs, matchers))
+            else:
+                # Copies start while the trees are still being compared
+                pipelined_sync(master, backup, jobs,
+                               on_copy=lambda op: _log_copy("Copied", op),
+                               matchers=matchers)
+                return
+    elif plan is None:
+        with metrics.phase("scan"):
+            master_dir = data.loaded_dir(master, master_matcher)
+            backup_dir = data.loaded_dir(backup, backup_matcher)
+
+        with metrics.phase("compare"):
+            diff = dirdiff.full_diff_dirs(master_dir, backup_dir)
+            plan = sync_plan(master, backup, diff)
 
+    for op in plan:
         if no_commit:
-            content_type = "directory" if master_copy.is_dir() else "file"
-            logger.info("Will copy %s %s >>>> %s",
-                        content_type,
-                        fspath(master_copy),
-                        fspath(backup_copy))
+            _log_copy("Will copy", op)
         else:
-            if master_copy.is_dir():
-                shutil.copytree(fspath(master_copy), fspath(backup_copy))
-                content_type = "directory"
-            else:
-                shutil.copy(fspath(master_copy), fspath(backup_copy))
-                content_type = "file"
+            with metrics.phase("copy"):
+                apply_copy(op, ignore)
+            _log_copy("Copied", op)
 
-            logger.info("Copied %s %s >>>> %s",
-                        content_type,
-                        fspath(master_copy),
-                        fspath(backup_copy))
+
+@click.group(
+    name="daemon",
+    short_help="Run or control the hearth daemon"
+)
+def daemon_grp():
+    pass
+
+
+@click.command(
+    name="run",
+    short_help="Run the daemon in the foreground"
+)
+@click.option("--watch", "watch_roots", multiple=True,
+              help="Track changes under this root directory while running")
+def daemon_run_cmd(watch_roots):
+    from hearth import client, daemon
+
+    daemon.serve(client.DEFAULT_SOCKET_PATH,
+                 DEFAULT_SAVE_PATH,
+                 DEFAULT_CATALOG_PATH,
+                 watch_roots=watch_roots)
+
+
+@click.command(
+    name="watch",
+    short_help="Journal changes under root directories until interrupted"
+)
+@click.argument("roots", nargs=-1)
+def watch_cmd(roots):
+    from hearth import stats as hstats
+    from hearth import sync_central
+    from hearth import watch
+
+    if not roots:
+        try:
+            central = _load_central()
+        except sync_central.SyncError:
+            logger.info("Current system is uninitialized."
+                        " Please run 'hearth init' to initialize first.")
+            return
+        roots = hstats.tracked_roots(central)
+
+    watcher = watch.Watcher(roots, DEFAULT_CATALOG_PATH)
+    try:
+        watcher.run()
+    except watch.WatchError as e:
+        logger.error("Couldn't watch for changes: %s", e)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+@click.command(
+    name="stop",
+    short_help="Stop a running daemon"
+)
+def daemon_stop_cmd():
+    from hearth import client
+
+    if client.request("shutdown") is None:
+        logger.info("No daemon is running")
+    else:
+        logger.info("Stopped the daemon")
+
+
+@click.command(
+    name="status",
+    short_help="Check whether the daemon is running"
+)
+def daemon_status_cmd():
+    from hearth import client
+
+    if client.is_running():
+        logger.info("Daemon is listening on '%s'", client.DEFAULT_SOCKET_PATH)
+    else:
+        logger.info("No daemon is running")
 
 
 def main():
+    daemon_grp.add_command(daemon_run_cmd)
+    daemon_grp.add_command(daemon_status_cmd)
+    daemon_grp.add_command(daemon_stop_cmd)
+
     root.add_command(compare_cmd)
+    root.add_command(daemon_grp)
     root.add_command(init_cmd)
     root.add_command(list_cmd)
+    root.add_command(mark_cmd)
+    root.add_command(search_cmd)
+    root.add_command(stats_cmd)
     root.add_command(sync_cmd)
+    root.add_command(watch_cmd)
     root()
 
 
@@ -0,0 +1,96 @@
+""" Phase timings and counters for a single hearth invocation
+
+Everything is a no-op until `enable` is called, so instrumented code only
+pays for an attribute check when metrics are off. Recording is safe from
+worker threads.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from os import PathLike, major, minor, stat
+from typing import Any, Dict, Iterator, Union
+
+
+@dataclass
+class Transfer:
+    bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def bytes_per_s(self) -> float:
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class Metrics:
+    enabled: bool = False
+    phases: Dict[str, float] = field(default_factory=dict)
+    counters: Dict[str, int] = field(default_factory=dict)
+    transfers: Dict[str, Transfer] = field(default_factory=dict)
+    extra: Dict[str, Any] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def clear(self) -> None:
+        self.phases.clear()
+        self.counters.clear()
+        self.transfers.clear()
+        self.extra.clear()
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """ Time a phase; time spent in repeated phases adds up """
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def transfer(self, path: Union[str, PathLike], nbytes: int, seconds: float) -> None:
+        """ Record bytes written to the device holding `path` """
+        if not self.enabled:
+            return
+
+        device = device_name(path)
+        with self._lock:
+            t = self.transfers.setdefault(device, Transfer())
+            t.bytes += nbytes
+            t.seconds += seconds
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "phases": dict(self.phases),
+            "counters": dict(self.counters),
+            "devices": {
+                name: {"bytes": t.bytes, "seconds": t.seconds, "bytes_per_s": t.bytes_per_s}
+                for name, t in self.transfers.items()
+            },
+            **self.extra,
+        }
+
+
+def device_name(path: Union[str, PathLike]) -> str:
+    """ Device number (major:minor) of the filesystem holding `path` """
+    try:
+        dev = stat(path).st_dev
+    except OSError:
+        return "unknown"
+
+    return f"{major(dev)}:{minor(dev)}"
+
+
+metrics = Metrics()
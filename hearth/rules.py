@@ -0,0 +1,233 @@
+""" Include and exclude rules applied while scanning
+
+A sync info's `ScanRules`, along with any .hearthignore files in its
+sources, compile into a `Matcher` once per scan. Scanners consult it for
+every entry they list, so excluded subdirectories are never listed, and
+excluded files are never compared or copied.
+"""
+import logging
+import re
+from fnmatch import translate
+from os import PathLike, fspath, stat, stat_result
+from os.path import dirname, isdir
+from os.path import join as ojoin
+from os.path import relpath
+from pathlib import Path
+from typing import (Callable, Dict, Iterable, List, Optional, Pattern, Sequence, Set, Tuple,
+                    Union)
+
+from hearth.metrics import metrics
+from hearth.sync_central import ScanRules, SyncCentral, sync_info_for
+
+logger = logging.getLogger(__name__)
+
+IGNORE_FILENAME = ".hearthignore"
+
+# (regex over root-relative paths, only matches directories)
+_Glob = Tuple[str, bool]
+
+
+def _glob(pattern: str, anchor: str = "") -> _Glob:
+    """ Regex for a glob defined in the directory `anchor` """
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    prefix = re.escape(anchor + "/") if anchor else ""
+    if not anchored:
+        prefix += "(?:.*/)?"
+
+    return prefix + translate(pattern), dir_only
+
+
+def _compiled(globs: Iterable[str]) -> Optional[Pattern]:
+    regexes = [f"(?:{g})" for g in globs]
+    return re.compile("|".join(regexes)) if regexes else None
+
+
+def _ignore_file_globs(path: Path, anchor: str) -> List[_Glob]:
+    """ Globs in an ignore file, one per line, skipping blanks and comments """
+    try:
+        lines = path.read_text(errors="surrogateescape").splitlines()
+    except OSError as e:
+        logger.warning("Could not read '%s': %s", path, e)
+        return []
+
+    return [_glob(line.strip(), anchor) for line in lines
+            if line.strip() and not line.lstrip().startswith("#")]
+
+
+def _rel(path: str, start: str) -> str:
+    rel = relpath(path, start)
+    return "" if rel == "." else rel
+
+
+class Matcher:
+    """ Compiled rules for one scanned tree
+
+    Paths given to it are relative to the directory the scan started at,
+    which may be below the root the rules are relative to.
+    """
+
+    def __init__(self,
+                 rules: ScanRules,
+                 excludes: Sequence[_Glob] = (),
+                 prefix: str = "") -> None:
+        self.rules = rules
+        self.excludes = tuple(excludes)
+        self.prefix = prefix
+
+        self._exclude = _compiled(g for g, dir_only in self.excludes if not dir_only)
+        self._exclude_dirs = _compiled(g for g, dir_only in self.excludes if dir_only)
+        self._include = _compiled(_glob(p)[0] for p in rules.include)
+
+        self._newer = rules.newer_than.timestamp() if rules.newer_than else None
+        self._older = rules.older_than.timestamp() if rules.older_than else None
+        self.needs_stat = any(v is not None for v in (rules.min_size, rules.max_size,
+                                                       self._newer, self._older))
+
+    def _path(self, rel: str) -> str:
+        if not self.prefix:
+            return rel
+        return ojoin(self.prefix, rel) if rel else self.prefix
+
+    def skips_dir(self, rel: str) -> bool:
+        path = self._path(rel)
+        skip = any(r is not None and r.match(path) for r in (self._exclude, self._exclude_dirs))
+        if skip:
+            metrics.count("entries_excluded")
+
+        return skip
+
+    def skips_file(self, rel: str, stat: Callable[[], stat_result]) -> bool:
+        """ Whether a file is excluded
+
+        :param stat: Only called when a size or time rule needs it
+        """
+        skip = self._skips_file(self._path(rel), stat)
+        if skip:
+            metrics.count("entries_excluded")
+
+        return skip
+
+    def _skips_file(self, path: str, stat: Callable[[], stat_result]) -> bool:
+        if self._exclude is not None and self._exclude.match(path):
+            return True
+        if self._include is not None and not self._include.match(path):
+            return True
+        if not self.needs_stat:
+            return False
+
+        try:
+            st = stat()
+        except OSError:
+            # Gone or unreadable; whatever scans it next reports that
+            return False
+
+        rules = self.rules
+        return ((rules.min_size is not None and st.st_size < rules.min_size)
+                or (rules.max_size is not None and st.st_size > rules.max_size)
+                or (self._newer is not None and st.st_mtime <= self._newer)
+                or (self._older is not None and st.st_mtime >= self._older))
+
+    def entering(self,
+                 rel: str,
+                 path: Union[str, PathLike],
+                 names: Iterable[str]) -> "Matcher":
+        """ Matcher for the entries of a directory, given the names listed in it
+
+        Picks up the directory's .hearthignore, if it has one.
+        """
+        if not self.rules.ignore_files or IGNORE_FILENAME not in names:
+            return self
+
+        globs = _ignore_file_globs(Path(path) / IGNORE_FILENAME, self._path(rel))
+        return Matcher(self.rules, self.excludes + tuple(globs), self.prefix)
+
+    def copy_ignore(self,
+                    scan_root: Union[str, PathLike]) -> Callable[[str, List[str]], Set[str]]:
+        """ `ignore` for shutil.copytree that leaves excluded entries out of copies
+
+        :param scan_root: Directory the scan this matcher is for started at
+        """
+        root = fspath(scan_root)
+        matchers: Dict[str, Matcher] = {}
+
+        def matcher_for(dirpath: str, names: Optional[List[str]] = None) -> "Matcher":
+            """ Matcher for the entries of `dirpath` """
+            if dirpath in matchers:
+                return matchers[dirpath]
+
+            # Directories above the copy were scanned, but their matchers
+            # are long gone, so pick up their ignore files again
+            if names is None:
+                names = [IGNORE_FILENAME] if Path(dirpath, IGNORE_FILENAME).is_file() else []
+            parent = self if dirpath == root else matcher_for(dirname(dirpath))
+            matchers[dirpath] = parent.entering(_rel(dirpath, root), dirpath, names)
+
+            return matchers[dirpath]
+
+        def ignore(dirpath: str, names: List[str]) -> Set[str]:
+            matcher = matcher_for(dirpath, names)
+            rel = _rel(dirpath, root)
+
+            skipped = set()
+            for name in names:
+                path = ojoin(dirpath, name)
+                if isdir(path):
+                    if matcher.skips_dir(ojoin(rel, name)):
+                        skipped.add(name)
+                elif matcher.skips_file(ojoin(rel, name), lambda: stat(path)):
+                    skipped.add(name)
+
+            return skipped
+
+        return ignore
+
+
+def compile_rules(rules: ScanRules,
+                  root: Union[str, PathLike],
+                  start: Optional[Union[str, PathLike]] = None) -> Matcher:
+    """ Compile rules relative to `root` for a scan starting at `start`
+
+    :param start: Directory at or below `root` the scan starts at; ignore
+        files between the two apply to it too
+    """
+    root_path = Path(root)
+    prefix = "" if start is None else _rel(fspath(start), fspath(root))
+
+    excludes = [_glob(p) for p in rules.exclude]
+    if rules.ignore_files and prefix:
+        # The start directory's own file gets read by `entering`
+        anchor = ""
+        for part in prefix.split("/"):
+            ignore_file = root_path / anchor / IGNORE_FILENAME
+            if ignore_file.is_file():
+                excludes += _ignore_file_globs(ignore_file, anchor)
+            anchor = ojoin(anchor, part)
+
+    return Matcher(rules, excludes, prefix)
+
+
+def matchers_for(central: SyncCentral,
+                 *paths: Union[str, PathLike]) -> Optional[List[Matcher]]:
+    """ Matchers for trees scanned together, such as the two sides of a diff
+
+    All of them use the rules of the first path that lies in a sync info's
+    source. Each tree still gets its own ignore files.
+
+    :returns: One matcher per path, or None if no sync info covers any of them
+    """
+    found = next(filter(None, (sync_info_for(central, p) for p in paths)), None)
+    if found is None:
+        return None
+
+    info, _ = found
+    matchers = []
+    for p in paths:
+        own = sync_info_for(central, p)
+        root = own[1] if own is not None and own[0] is info else p
+        matchers.append(compile_rules(info.rules, root, p))
+
+    return matchers
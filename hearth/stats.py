@@ -0,0 +1,96 @@
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set
+
+import psutil  # type: ignore
+
+from hearth.catalog import Catalog, CatalogError, RootSummary
+from hearth.sync_central import Device, SyncCentral
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DeviceStats:
+    name: str
+    mountpoint: str
+    total: int
+    used: int
+    free: int
+
+
+@dataclass
+class Stats:
+    devices: List[DeviceStats]
+    roots: Dict[str, Optional[RootSummary]]
+
+    @property
+    def total_capacity(self) -> int:
+        return sum(d.total for d in self.devices)
+
+    @property
+    def total_used(self) -> int:
+        return sum(d.used for d in self.devices)
+
+
+def tracked_roots(central: SyncCentral) -> Set[str]:
+    """ All root directories referenced by the central's sync infos """
+    return {
+        path
+        for info in central.sync_infos.values()
+        for path in info.sources.values()
+    }
+
+
+def device_stats(devices: Dict[str, Device]) -> List[DeviceStats]:
+    """ Capacity of every device that's currently mounted """
+    stats = []
+    for name, device in devices.items():
+        if not device.mounted:
+            continue
+
+        try:
+            usage = psutil.disk_usage(device.mountpoint)
+        except OSError as e:
+            logger.warning("Skipping device %s: %s", name, e)
+            continue
+
+        stats.append(DeviceStats(name,
+                                 device.mountpoint,
+                                 usage.total,
+                                 usage.used,
+                                 usage.free))
+
+    return stats
+
+
+def root_stats(catalog: Catalog,
+               roots: Iterable[str],
+               refresh: bool = False) -> Dict[str, Optional[RootSummary]]:
+    """ Indexed size rollups per root directory
+
+    Roots that were never scanned map to None unless `refresh` is set, in
+    which case every root is (incrementally) rescanned first.
+    """
+    summaries: Dict[str, Optional[RootSummary]] = {}
+    for root in sorted(roots):
+        if refresh:
+            try:
+                summaries[root] = catalog.refresh_root(root)
+            except (CatalogError, OSError) as e:
+                logger.warning("Couldn't refresh %s: %s", root, e)
+                summaries[root] = catalog.root_summary(root)
+        else:
+            summaries[root] = catalog.root_summary(root)
+
+    return summaries
+
+
+def gather_stats(central: SyncCentral,
+                 catalog: Catalog,
+                 roots: Iterable[str] = (),
+                 refresh: bool = False) -> Stats:
+    return Stats(
+        devices=device_stats(central.devices),
+        roots=root_stats(catalog, roots or tracked_roots(central), refresh=refresh)
+    )
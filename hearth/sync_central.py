@@ -1,7 +1,9 @@
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
+from os import PathLike, sep
+from os.path import abspath
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional, Tuple, Union
 
 import toml
 
@@ -10,6 +12,29 @@ import toml
 class Device:
     name: str
     mountpoint: str
+    node: str = ""
+    uuid: Optional[str] = None
+    label: Optional[str] = None
+    marker: Optional[str] = None
+    mounted: bool = True
+
+
+@dataclass
+class ScanRules:
+    """ What to leave out when scanning the sources of a sync info
+
+    Globs without a slash match names at any depth, globs with one match
+    paths from the source root, and a trailing slash only matches
+    directories. Includes, sizes and times only filter files. Globs from
+    .hearthignore files are relative to the directory holding them.
+    """
+    include: List[str] = field(default_factory=list)
+    exclude: List[str] = field(default_factory=list)
+    min_size: Optional[int] = None
+    max_size: Optional[int] = None
+    newer_than: Optional[datetime] = None
+    older_than: Optional[datetime] = None
+    ignore_files: bool = True
 
 
 @dataclass
@@ -18,6 +43,7 @@ class SyncInfo:
     description: str
     primary_source: str
     sources: Dict[str, str]
+    rules: ScanRules = field(default_factory=ScanRules)
 
 
 @dataclass
@@ -41,7 +67,7 @@ def get_sync_central(path: Path) -> SyncCentral:
         central_dict = toml.load(f)
 
         sync_infos = {
-            name: SyncInfo(**info)
+            name: SyncInfo(**{**info, "rules": ScanRules(**info.get("rules", {}))})
             for name, info in central_dict["sync_infos"].items()
         }
 
@@ -73,3 +99,21 @@ def save_sync_central(central: SyncCentral,
 
     with path.open(mode="w") as f:
         toml.dump(central_dict, f)
+
+
+def sync_info_for(central: SyncCentral,
+                  path: Union[str, PathLike]) -> Optional[Tuple[SyncInfo, str]]:
+    """ Sync info with a source holding `path`, along with that source
+
+    The deepest source wins when sources are nested.
+    """
+    full_path = abspath(path)
+    found: Optional[Tuple[SyncInfo, str]] = None
+    for info in central.sync_infos.values():
+        for source in map(abspath, info.sources.values()):
+            if full_path != source and not full_path.startswith(source.rstrip(sep) + sep):
+                continue
+            if found is None or len(source) > len(found[1]):
+                found = (info, source)
+
+    return found
@@ -0,0 +1,299 @@
+""" Live change tracking for tracked roots through Linux inotify
+
+A `Watcher` journals every directory whose contents change into the
+catalog, so refreshing a watched root only relists those directories. When
+inotify runs out of watches or drops events, the affected subtrees are
+journaled for an mtime-guided rescan instead.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from os import PathLike, fspath, scandir
+from os.path import join as ojoin
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from hearth.catalog import Catalog
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+               | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+# struct inotify_event without its trailing name
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+# Root, changed directory and whether its whole subtree needs a look
+Change = Tuple[str, str, bool]
+
+
+class WatchError(Exception):
+    pass
+
+
+class Inotify:
+    """ Thin wrapper over the inotify syscalls """
+
+    def __init__(self) -> None:
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            init = self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise WatchError("inotify isn't available on this system")
+
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise WatchError(os.strerror(ctypes.get_errno()))
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+    def add_watch(self, path: str, mask: int = _WATCH_MASK) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> List[Tuple[int, int, str]]:
+        """ Pending events as (watch descriptor, mask, name) """
+        try:
+            buf = os.read(self.fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, name_len = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            name = buf[offset:offset + name_len].rstrip(b"\0")
+            offset += name_len
+            events.append((wd, mask, os.fsdecode(name)))
+
+        return events
+
+
+class Watcher:
+    """ Journals changes under root directories for as long as it runs
+
+    :param roots: Root directories to watch
+    :param catalog_path: Catalog to journal changes into
+    :param flush_interval: Seconds to batch changes for before journaling
+    :param on_change: Called with every batch of journaled changes
+    :param on_unwatched: Called with every directory that couldn't be watched
+        for lack of watches, so changes under it go unreported
+    """
+
+    def __init__(self,
+                 roots: Iterable[Union[str, PathLike]],
+                 catalog_path: PathLike,
+                 flush_interval: float = 1.0,
+                 on_change: Optional[Callable[[List[Change]], None]] = None,
+                 on_unwatched: Optional[Callable[[str], None]] = None) -> None:
+        self.roots = sorted({fspath(Path(r).resolve()) for r in roots})
+        self.catalog_path = catalog_path
+        self.flush_interval = flush_interval
+        self.on_change = on_change
+        self.on_unwatched = on_unwatched
+        self.ready = threading.Event()
+
+        self._stopped = threading.Event()
+        self._wds: Dict[int, Tuple[str, str]] = {}
+        self._pending: Dict[Tuple[str, str], bool] = {}
+
+        # Pipe that wakes the watch loop up for `sync`, while it runs
+        self._wakeup: Optional[Tuple[int, int]] = None
+        self._syncs: List[threading.Event] = []
+        self._sync_lock = threading.Lock()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        with self._sync_lock:
+            if self._wakeup is not None:
+                os.write(self._wakeup[1], b"\0")
+
+    def sync(self, timeout: Optional[float] = None) -> bool:
+        """ Journal every change made before the call, without waiting for a flush
+
+        Called from other threads, such as one about to read what the
+        watcher journals.
+
+        :returns: Whether the watcher caught up within `timeout`
+        """
+        done = threading.Event()
+        with self._sync_lock:
+            if self._wakeup is None:
+                return False
+            self._syncs.append(done)
+            os.write(self._wakeup[1], b"\0")
+
+        return done.wait(timeout)
+
+    def run(self) -> None:
+        """ Watch until `stop` is called """
+        inotify = Inotify()
+        catalog = Catalog(self.catalog_path)
+        wakeup_fd, wakeup_write_fd = os.pipe()
+        with self._sync_lock:
+            self._wakeup = (wakeup_fd, wakeup_write_fd)
+
+        try:
+            for root in self.roots:
+                catalog.start_watching(root)
+                self._add_tree(inotify, catalog, root, root)
+                # A refresh could've consumed the journal while watches were
+                # still being added, so cover that window as well
+                self._pending[(root, root)] = True
+            self._flush(catalog)
+
+            logger.info("Watching %d directories under %d roots",
+                        len(self._wds), len(self.roots))
+            self.ready.set()
+
+            last_flush = time.monotonic()
+            while not self._stopped.is_set():
+                readable, _, _ = select.select([inotify.fd, wakeup_fd], [],
+                                               [], self.flush_interval)
+                if inotify.fd in readable:
+                    self._handle_events(inotify, catalog, inotify.read_events())
+
+                if wakeup_fd in readable:
+                    os.read(wakeup_fd, _READ_SIZE)
+                    self._synced(inotify, catalog)
+                    last_flush = time.monotonic()
+                elif time.monotonic() - last_flush >= self.flush_interval:
+                    self._flush(catalog)
+                    last_flush = time.monotonic()
+
+            self._synced(inotify, catalog)
+        finally:
+            with self._sync_lock:
+                self._wakeup = None
+            os.close(wakeup_fd)
+            os.close(wakeup_write_fd)
+            for root in self.roots:
+                catalog.stop_watching(root)
+            catalog.close()
+            inotify.close()
+
+    def _synced(self, inotify: Inotify, catalog: Catalog) -> None:
+        """ Journal every event queued so far and release whoever waits on it """
+        with self._sync_lock:
+            syncs, self._syncs = self._syncs, []
+
+        # Events are queued by the time the calls causing them return, so
+        # draining the queue covers every change made before the syncs
+        events = inotify.read_events()
+        while events:
+            self._handle_events(inotify, catalog, events)
+            events = inotify.read_events()
+        self._flush(catalog)
+
+        for done in syncs:
+            done.set()
+
+    def _add_tree(self,
+                  inotify: Inotify,
+                  catalog: Catalog,
+                  root: str,
+                  path: str) -> None:
+        remaining = [path]
+        while remaining:
+            dir_path = remaining.pop()
+            try:
+                wd = inotify.add_watch(dir_path)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    logger.warning("Out of inotify watches, %s will be rescanned"
+                                   " on every refresh", dir_path)
+                    catalog.mark_unwatched(root, dir_path)
+                    self._pending[(root, dir_path)] = True
+                    if self.on_unwatched is not None:
+                        self.on_unwatched(dir_path)
+                else:
+                    logger.debug("Couldn't watch %s: %s", dir_path, e)
+                continue
+
+            self._wds[wd] = (root, dir_path)
+            try:
+                with scandir(dir_path) as it:
+                    remaining.extend(e.path for e in it if e.is_dir(follow_symlinks=False))
+            except OSError as e:
+                logger.debug("Couldn't list %s: %s", dir_path, e)
+
+    def _forget_tree(self, inotify: Inotify, path: str) -> None:
+        prefix = path + os.sep
+        for wd, (_, dir_path) in list(self._wds.items()):
+            if dir_path == path or dir_path.startswith(prefix):
+                inotify.rm_watch(wd)
+                del self._wds[wd]
+
+    def _handle_events(self,
+                       inotify: Inotify,
+                       catalog: Catalog,
+                       events: List[Tuple[int, int, str]]) -> None:
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify dropped events, rescanning all watched roots")
+                for root in self.roots:
+                    self._pending[(root, root)] = True
+                continue
+
+            watched = self._wds.get(wd)
+            if watched is None:
+                continue
+
+            root, dir_path = watched
+            if mask & IN_IGNORED:
+                del self._wds[wd]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # The parent directory reports this change on its own
+                continue
+
+            key = (root, dir_path)
+            self._pending[key] = self._pending.get(key, False)
+
+            if mask & IN_ISDIR:
+                child = ojoin(dir_path, name)
+                if mask & IN_MOVED_FROM:
+                    self._forget_tree(inotify, child)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(inotify, catalog, root, child)
+
+    def _flush(self, catalog: Catalog) -> None:
+        if not self._pending:
+            return
+
+        changes = [(root, path, recursive)
+                   for (root, path), recursive in self._pending.items()]
+        self._pending = {}
+
+        catalog.journal_changes(changes)
+        if self.on_change is not None:
+            self.on_change(changes)
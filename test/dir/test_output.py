@@ -0,0 +1,106 @@
+import io
+import json
+from pathlib import Path
+
+import pytest  # type: ignore
+
+import hearth.dir.output as sut
+from hearth.dir.data import loaded_dir
+from hearth.dir.diff import full_diff_dirs
+
+
+@pytest.fixture(scope="function")
+def diffed(tmpdir_factory):
+    src = Path(str(tmpdir_factory.mktemp("src")))
+    target = Path(str(tmpdir_factory.mktemp("target")))
+
+    (src / "same.txt").write_text("same")
+    (target / "same.txt").write_text("same")
+    (src / "changed.txt").write_text("before")
+    (target / "changed.txt").write_text("after!")
+    (src / "missing.txt").write_text("12345")
+    (target / "new.txt").write_text("1")
+    (src / "missing_dir").mkdir()
+    (src / "missing_dir" / "a").write_text("abc")
+    (src / "missing_dir" / "b").write_text("de")
+
+    yield full_diff_dirs(loaded_dir(src), loaded_dir(target)), src, target
+
+
+def _written(diff, fmt, statuses=sut.DEFAULT_STATUSES, src="", target=""):
+    out = io.StringIO()
+    sut.write_diff(diff, out, fmt, statuses, src, target)
+    return out.getvalue()
+
+
+def test_write_text(diffed):
+    diff, _, _ = diffed
+
+    assert _written(diff, "text").splitlines() == [
+        "changed  file changed.txt",
+        "missing  file missing.txt",
+        "missing  dir  missing_dir",
+        "new      file new.txt",
+    ]
+
+
+def test_sorted_entries():
+    entries = [("file", "new", "b"), ("file", "new", "a"),
+               ("dir", "new", "d"), ("dir", "new", "c"),
+               ("file", "missing", "z"), ("file", "missing", "y")]
+
+    assert list(sut.sorted_entries(entries)) == [
+        ("file", "new", "a"), ("file", "new", "b"),
+        ("dir", "new", "c"), ("dir", "new", "d"),
+        ("file", "missing", "y"), ("file", "missing", "z"),
+    ]
+
+
+def test_write_jsonl(diffed):
+    diff, _, _ = diffed
+
+    lines = _written(diff, "jsonl", ["missing", "shared"]).splitlines()
+
+    assert sorted(map(json.loads, lines), key=lambda e: e["path"]) == [
+        {"type": "file", "status": "missing", "path": "missing.txt"},
+        {"type": "dir", "status": "missing", "path": "missing_dir"},
+        {"type": "file", "status": "shared", "path": "same.txt"},
+    ]
+
+
+def test_write_null(diffed):
+    diff, _, _ = diffed
+
+    out = _written(diff, "null", ["changed", "new"])
+
+    assert out.endswith("\0")
+    assert sorted(out.split("\0")[:-1]) == ["changed.txt", "new.txt"]
+
+
+def test_write_summary(diffed):
+    diff, src, target = diffed
+
+    summary = json.loads(_written(diff, "summary", src=src, target=target))
+
+    assert summary == {
+        "files": {
+            "changed": {"count": 1, "bytes": 6},
+            "missing": {"count": 1, "bytes": 5},
+            "new": {"count": 1, "bytes": 1},
+        },
+        "subdirs": {
+            "missing": {"count": 1, "bytes": 5},
+            "new": {"count": 0, "bytes": 0},
+        },
+    }
+
+
+@pytest.mark.parametrize("fmt, statuses", [
+    ("yaml", sut.DEFAULT_STATUSES),
+    ("text", ["renamed"]),
+])
+def test_write_diff_rejects_unknown(diffed, fmt, statuses):
+    diff, _, _ = diffed
+
+    with pytest.raises(sut.OutputError):
+        _written(diff, fmt, statuses)
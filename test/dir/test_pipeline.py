@@ -0,0 +1,63 @@
+import shutil
+from pathlib import Path
+
+import pytest  # type: ignore
+
+import hearth.dir.pipeline as sut
+from hearth.dir.data import loaded_dir
+from hearth.dir.diff import full_diff_dirs
+from hearth.dir.sync import sync_plan
+from helpers.tree_gen import TreeSpec, generate_tree, mutate_tree
+
+
+@pytest.fixture(scope="function")
+def trees(tmpdir_factory):
+    """ A master tree and a backup with some of its files changed, removed or added """
+    master = Path(str(tmpdir_factory.mktemp("master")))
+    backup = Path(str(tmpdir_factory.mktemp("backup"))) / "backup"
+
+    files = generate_tree(master, TreeSpec(depth=3, fanout=3, files_per_dir=4, file_size=256))
+    shutil.copytree(str(master), str(backup))
+    mutate_tree([backup / f.relative_to(master) for f in files], 0.2, seed=3)
+    shutil.rmtree(str(backup / "dir0001" / "dir0002"))
+    (backup / "dir0002" / "extra").mkdir()
+
+    yield master, backup
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_pipelined_diff_matches_full_diff(trees, jobs):
+    master, backup = trees
+
+    expected = full_diff_dirs(loaded_dir(master), loaded_dir(backup))
+
+    assert sut.pipelined_diff(master, backup, jobs=jobs) == expected
+
+
+def test_pipelined_diff_identical_trees(trees):
+    master, _ = trees
+
+    diff = sut.pipelined_diff(master, master)
+
+    assert not diff
+    assert diff.subdirs.shared == {"dir0000", "dir0001", "dir0002"}
+
+
+def test_pipelined_sync(trees):
+    master, backup = trees
+    expected_diff = full_diff_dirs(loaded_dir(master), loaded_dir(backup))
+    expected_ops = sync_plan(master, backup, expected_diff)
+    seen = []
+
+    diff, copied = sut.pipelined_sync(master, backup, jobs=4, on_copy=seen.append)
+
+    assert diff == expected_diff
+    assert sorted(copied, key=lambda op: op.src) == expected_ops
+    assert seen == copied
+    assert not full_diff_dirs(loaded_dir(master), loaded_dir(backup)).files.changed
+    assert not sut.pipelined_diff(master, backup).files.missing
+
+
+def test_pipelined_diff_missing_root(tmpdir):
+    with pytest.raises(FileNotFoundError):
+        sut.pipelined_diff(str(tmpdir), str(tmpdir / "nope"))
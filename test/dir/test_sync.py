@@ -1,6 +1,11 @@
 import pytest # type: ignore
 
 from hearth.dir.data import Dir, loaded_dir
+from hearth.dir.diff import full_diff_dirs
+from hearth.dir.sync import apply_copy, sync_plan
+
+import helpers.dir_schemas
+from helpers.dir_schemas import create_dir
 
 
 # Test no sync for identical directories
@@ -11,4 +16,17 @@ from hearth.dir.data import Dir, loaded_dir
 #   - One nested subdir and one with only files
 
 def test_placeholder():
-    pass
\ No newline at end of file
+    pass
+
+
+def test_sync_plan_copies_into_place(tmpdir_factory):
+    master = tmpdir_factory.mktemp("master")
+    backup = tmpdir_factory.mktemp("backup")
+    create_dir(master, helpers.dir_schemas.multiple_subdir_levels(master))
+    (backup / "sublevel1").mkdir()
+
+    diff = full_diff_dirs(loaded_dir(master), loaded_dir(backup))
+    for op in sync_plan(master, backup, diff):
+        apply_copy(op)
+
+    assert not full_diff_dirs(loaded_dir(master), loaded_dir(backup))
@@ -0,0 +1,126 @@
+import random
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+
+_BLOCK_SIZE = 1 << 20
+
+
+@dataclass
+class TreeSpec:
+    """ Shape of a synthetic media tree
+
+    :param depth: Levels of subdirectories below the root
+    :param fanout: Subdirectories per directory
+    :param files_per_dir: Files in every directory, including the root
+    :param file_size: Size of every file in bytes
+    """
+    depth: int
+    fanout: int
+    files_per_dir: int
+    file_size: int
+
+    @property
+    def num_dirs(self) -> int:
+        return sum(self.fanout ** level for level in range(self.depth + 1))
+
+    @property
+    def num_files(self) -> int:
+        return self.num_dirs * self.files_per_dir
+
+    def scaled(self, scale: float) -> "TreeSpec":
+        """ Same shape with `scale` times as many files per directory """
+        return TreeSpec(self.depth,
+                        self.fanout,
+                        max(1, round(self.files_per_dir * scale)),
+                        self.file_size)
+
+
+SHAPES: Dict[str, TreeSpec] = {
+    "wide": TreeSpec(depth=1, fanout=200, files_per_dir=20, file_size=4 << 10),
+    "deep": TreeSpec(depth=40, fanout=1, files_per_dir=10, file_size=4 << 10),
+    "many_small": TreeSpec(depth=3, fanout=6, files_per_dir=40, file_size=512),
+    "few_huge": TreeSpec(depth=1, fanout=2, files_per_dir=2, file_size=64 << 20),
+}
+
+
+def _write_file(path: Path, size: int, block: bytes, salt: str) -> None:
+    # Every file starts with its own salt so no two files compare equal
+    header = f"{path.name}:{salt}:".encode()[:size]
+    with path.open("wb") as f:
+        f.write(header)
+        remaining = size - len(header)
+        while remaining > 0:
+            chunk = block[:remaining]
+            f.write(chunk)
+            remaining -= len(chunk)
+
+
+def generate_tree(path: Path, spec: TreeSpec, seed: int = 0) -> List[Path]:
+    """ Create a tree of the given shape in an existing directory
+
+    Contents are deterministic for a given seed.
+
+    :returns: Every file that was created
+    """
+    rng = random.Random(seed)
+    block = rng.getrandbits(8 * _BLOCK_SIZE).to_bytes(_BLOCK_SIZE, "little")
+
+    files = []
+    level = [path]
+    for depth in range(spec.depth + 1):
+        next_level = []
+        for dir_path in level:
+            for i in range(spec.files_per_dir):
+                file_path = dir_path / f"file{i:05d}.bin"
+                _write_file(file_path, spec.file_size, block, str(seed))
+                files.append(file_path)
+
+            if depth < spec.depth:
+                for i in range(spec.fanout):
+                    subdir = dir_path / f"dir{i:04d}"
+                    subdir.mkdir()
+                    next_level.append(subdir)
+        level = next_level
+
+    return files
+
+
+@dataclass
+class Mutation:
+    changed: List[Path]
+    removed: List[Path]
+    added: List[Path]
+
+
+def mutate_tree(files: List[Path],
+                change_rate: float,
+                seed: int = 0,
+                min_changes: int = 0) -> Mutation:
+    """ Change, remove and add files in a generated tree
+
+    A `change_rate` share of the files is touched, split evenly between
+    rewritten, removed and newly added files.
+
+    :param min_changes: Files to touch at least, for trees so small the
+                        change rate rounds down to next to nothing
+    """
+    rng = random.Random(seed)
+    picked = rng.sample(files, min(len(files),
+                                   max(min_changes, round(len(files) * change_rate))))
+    third = len(picked) // 3
+
+    changed = picked[:third]
+    removed = picked[third:2 * third]
+    added = [p.with_name(f"new-{p.name}") for p in picked[2 * third:]]
+
+    for p in changed:
+        size = p.stat().st_size
+        with p.open("r+b") as f:
+            f.write(b"\xff" * min(size, 64))
+    for p in removed:
+        p.unlink()
+    for p in added:
+        p.write_bytes(b"added" + p.name.encode())
+
+    return Mutation(changed, removed, added)
@@ -0,0 +1,151 @@
+import os
+from pathlib import Path
+
+import pytest  # type: ignore
+
+import hearth.catalog as sut
+import helpers.dir_schemas
+from helpers.dir_schemas import create_dir
+
+
+@pytest.fixture(scope="function", params=["trigram", "no-trigram"])
+def catalog(request, tmpdir, monkeypatch):
+    if request.param == "no-trigram":
+        # What SQLite older than 3.34 says
+        monkeypatch.setattr(sut, "_NAMES_SCHEMA",
+                            sut._NAMES_SCHEMA.replace("'trigram'", "'no-such-tokenizer'"))
+
+    with sut.Catalog(Path(str(tmpdir)) / "catalog.db") as c:
+        yield c
+
+
+@pytest.fixture(scope="function")
+def root_path(tmpdir_factory):
+    path = Path(str(tmpdir_factory.mktemp("root")))
+    create_dir(path,
+               helpers.dir_schemas.multiple_subdir_levels(path),
+               empty_files=False)
+
+    return path
+
+
+def _disk_totals(path: Path):
+    sizes = [p.stat().st_size for p in path.rglob("*") if p.is_file()]
+    return sum(sizes), len(sizes)
+
+
+def test_unscanned_root_has_no_summary(catalog, root_path):
+    assert catalog.root_summary(root_path) is None
+
+
+def test_refresh_root_rolls_up_sizes(catalog, root_path):
+    summary = catalog.refresh_root(root_path)
+
+    assert (summary.total_size, summary.total_files) == _disk_totals(root_path)
+    assert summary.last_scanned is not None
+    assert catalog.root_summary(root_path) == summary
+
+
+def test_refresh_root_picks_up_changes(catalog, root_path):
+    catalog.refresh_root(root_path)
+
+    deep = root_path / "sublevel1" / "sublevel2"
+    (deep / "new.bin").write_bytes(b"x" * 100)
+    (deep / "Secret Pictures" / "SECRET.png").unlink()
+    (root_path / "sublevel1" / "Pictures" / "extra").mkdir()
+    (root_path / "sublevel1" / "Pictures" / "extra" / "a.jpg").write_bytes(b"y" * 7)
+
+    summary = catalog.refresh_root(root_path)
+
+    assert (summary.total_size, summary.total_files) == _disk_totals(root_path)
+
+
+def test_refresh_root_handles_removed_subtree(catalog, root_path):
+    catalog.refresh_root(root_path)
+
+    pictures = root_path / "sublevel1" / "Pictures"
+    for f in pictures.iterdir():
+        f.unlink()
+    pictures.rmdir()
+
+    summary = catalog.refresh_root(root_path)
+
+    assert (summary.total_size, summary.total_files) == _disk_totals(root_path)
+
+
+def test_refresh_missing_root(catalog, tmpdir):
+    with pytest.raises(sut.CatalogError):
+        catalog.refresh_root(Path(str(tmpdir)) / "nope")
+
+
+@pytest.mark.parametrize("query, expected", [
+    (sut.SearchQuery(substring="secret"), {"sublevel1/sublevel2/Secret Pictures",
+                                           "sublevel1/sublevel2/Secret Pictures/SECRET.png"}),
+    (sut.SearchQuery(substring="js"), {"sublevel1/sublevel2/ugh.js"}),
+    (sut.SearchQuery(glob="*.jpg"), {"sublevel1/Pictures/img1.jpg",
+                                     "sublevel1/Pictures/img2.jpg"}),
+    (sut.SearchQuery(glob="img[2].jpg"), {"sublevel1/Pictures/img2.jpg"}),
+    (sut.SearchQuery(glob="sublevel*", is_dir=True), {"sublevel1",
+                                                      "sublevel1/sublevel2"}),
+    (sut.SearchQuery(glob="*.jpg", is_dir=False, min_size=10**6), set()),
+])
+def test_search(catalog, root_path, query, expected):
+    catalog.refresh_root(root_path)
+
+    assert {r.path for r in catalog.search(query)} == expected
+
+
+def test_search_forgets_removed_entries(catalog, root_path):
+    catalog.refresh_root(root_path)
+
+    secret = root_path / "sublevel1" / "sublevel2" / "Secret Pictures"
+    (secret / "SECRET.png").unlink()
+    secret.rmdir()
+    catalog.refresh_root(root_path)
+
+    assert not list(catalog.search(sut.SearchQuery(substring="secret")))
+
+
+def test_search_unmounted_root(catalog, root_path, tmpdir):
+    catalog.refresh_root(root_path)
+    moved = Path(str(tmpdir)) / "unplugged"
+    root_path.rename(moved)
+
+    results = list(catalog.search(sut.SearchQuery(glob="*.png")))
+
+    assert [r.fullpath for r in results] == [
+        os.path.join(root_path, "sublevel1/sublevel2/Secret Pictures/SECRET.png")
+    ]
+
+
+def test_journal_keeps_one_row_per_directory(catalog, root_path):
+    catalog.refresh_root(root_path)
+    sub = root_path / "sublevel1"
+
+    for _ in range(3):
+        catalog.journal_changes([(root_path, sub, False)])
+    catalog.journal_changes([(root_path, sub, True)])
+    catalog.journal_changes([(root_path, sub, False)])
+
+    assert catalog._take_journal(catalog._root_id(sut._root_key(root_path))) == {"sublevel1": True}
+
+
+def test_journal_rows_are_merged_on_upgrade(tmpdir):
+    path = Path(str(tmpdir)) / "catalog.db"
+    with sut.Catalog(path) as c:
+        c._conn.executescript("""
+            DROP TABLE journal;
+            CREATE TABLE journal (
+                id INTEGER PRIMARY KEY,
+                root_id INTEGER NOT NULL REFERENCES roots(id) ON DELETE CASCADE,
+                path TEXT NOT NULL,
+                recursive INTEGER NOT NULL
+            );
+        """)
+        root_id = c._root_id("/media/usb")
+        c._conn.executemany("INSERT INTO journal (root_id, path, recursive) VALUES (?, ?, ?)",
+                            [(root_id, "a", 0), (root_id, "a", 1), (root_id, "b", 0)])
+        c._conn.commit()
+
+    with sut.Catalog(path) as c:
+        assert c._take_journal(root_id) == {"a": True, "b": False}
@@ -0,0 +1,237 @@
+import datetime as dt
+import socket
+import threading
+import time
+from pathlib import Path
+
+import pytest  # type: ignore
+
+import hearth.daemon as sut
+import helpers.dir_schemas
+from hearth import client
+from hearth.catalog import SearchQuery
+from hearth.dir.data import loaded_dir
+from hearth.dir.diff import full_diff_dirs
+from hearth.dir.output import diff_entries
+from hearth.sync_central import SyncCentral, save_sync_central
+from hearth.watch import Watcher
+from helpers.dir_schemas import create_dir
+
+
+@pytest.fixture(scope="function")
+def daemon(tmpdir):
+    tmp_path = Path(str(tmpdir))
+    socket_path = tmp_path / "hearth.sock"
+    now = dt.datetime.now()
+    save_sync_central(SyncCentral(str(tmp_path / "central.toml"), {}, now, now, {}),
+                      create_if_exists=True)
+
+    state = sut.DaemonState(tmp_path / "central.toml", tmp_path / "catalog.db")
+    server = sut.DaemonServer(socket_path, state)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.start()
+
+    yield socket_path
+
+    client.request("shutdown", socket_path)
+    thread.join()
+    server.server_close()
+
+
+@pytest.fixture(scope="function")
+def dirs(tmpdir_factory):
+    paths = []
+    for name, seed in [("src", "SRC"), ("cmp", "CMP")]:
+        path = Path(str(tmpdir_factory.mktemp(name)))
+        create_dir(path,
+                   helpers.dir_schemas.multiple_subdir_levels(path),
+                   empty_files=False,
+                   seed=seed)
+        paths.append(path)
+
+    return paths
+
+
+def test_no_daemon(tmpdir):
+    socket_path = Path(str(tmpdir)) / "hearth.sock"
+
+    assert not client.is_running(socket_path)
+    assert client.request("ping", socket_path) is None
+    assert client.remote_compare(tmpdir, tmpdir, socket_path) is None
+
+
+def test_ping(daemon):
+    assert client.is_running(daemon)
+
+
+def test_unknown_command(daemon):
+    with pytest.raises(client.DaemonError):
+        client.request("nope", daemon)
+
+
+def test_slow_requests_dont_hold_up_others(tmpdir):
+    socket_path = Path(str(tmpdir)) / "hearth.sock"
+    state = sut.DaemonState(Path(str(tmpdir)) / "central.toml",
+                            Path(str(tmpdir)) / "catalog.db")
+    release = threading.Event()
+    state.handlers["slow"] = lambda: release.wait(5)
+    server = sut.DaemonServer(socket_path, state)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.start()
+
+    results = []
+    slow = threading.Thread(
+        target=lambda: results.append(client.request("slow", socket_path, timeout=0.1)))
+    slow.start()
+    try:
+        assert client.is_running(socket_path)
+        time.sleep(0.3)
+    finally:
+        release.set()
+        slow.join()
+        # Accepted requests get waited for well past the accept timeout
+        assert results == [True]
+        client.request("shutdown", socket_path)
+        thread.join()
+        server.server_close()
+
+
+def test_daemons_not_accepting_requests_get_skipped(tmpdir):
+    socket_path = Path(str(tmpdir)) / "hearth.sock"
+    # Takes connections but never reads from them, like a wedged daemon
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as wedged:
+        wedged.bind(str(socket_path))
+        wedged.listen()
+
+        assert client.request("ping", socket_path, timeout=0.1) is None
+
+
+def test_remote_compare_matches_local(daemon, dirs):
+    src, cmp = dirs
+    expected = full_diff_dirs(loaded_dir(src), loaded_dir(cmp))
+
+    assert client.remote_compare(src, cmp, daemon) == expected
+
+
+def test_remote_diff_entries_are_streamed(daemon, dirs):
+    src, cmp = dirs
+    expected = list(diff_entries(full_diff_dirs(loaded_dir(src), loaded_dir(cmp)),
+                                 ["missing", "new"]))
+
+    entries = client.remote_diff_entries(src, cmp, ["missing", "new"], daemon)
+
+    assert sorted(entries) == sorted(expected)
+
+
+def test_broken_off_streams_raise(tmpdir):
+    socket_path = Path(str(tmpdir)) / "hearth.sock"
+    state = sut.DaemonState(Path(str(tmpdir)) / "central.toml",
+                            Path(str(tmpdir)) / "catalog.db")
+
+    def failing():
+        yield 1
+        raise OSError("gone")
+
+    state.handlers["failing"] = failing
+    server = sut.DaemonServer(socket_path, state)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.start()
+
+    try:
+        items = client.stream_request("failing", socket_path)
+        assert next(items) == 1
+        with pytest.raises(client.DaemonError):
+            next(items)
+    finally:
+        client.request("shutdown", socket_path)
+        thread.join()
+        server.server_close()
+
+
+def test_remote_compare_sees_changes(daemon, dirs):
+    src, cmp = dirs
+    client.remote_compare(src, cmp, daemon)
+
+    (src / "sublevel1" / "Pictures" / "new.jpg").write_text("new")
+    diff = client.remote_compare(src, cmp, daemon)
+
+    assert "sublevel1/Pictures/new.jpg" in diff.files.missing
+
+
+def test_remote_sync_plan(daemon, dirs):
+    src, cmp = dirs
+    plan = client.remote_sync_plan(src, cmp, daemon)
+
+    assert plan
+    assert all(op.src.startswith(str(src)) for op in plan)
+    assert all(op.dst.startswith(str(cmp)) for op in plan)
+
+
+def test_remote_search_and_stats(daemon, dirs):
+    src, _ = dirs
+    stats = client.remote_stats([str(src)], True, daemon)
+    results = client.remote_search(SearchQuery(glob="*.png"), daemon)
+
+    assert stats.roots[str(src)].total_files == 10
+    assert [r.path for r in results] == ["sublevel1/sublevel2/Secret Pictures/SECRET.png"]
+
+
+def test_watched_trees_relist_only_dirty_directories(tmpdir, dirs):
+    src, _ = dirs
+    state = sut.DaemonState(Path(str(tmpdir)) / "central.toml",
+                            Path(str(tmpdir)) / "catalog.db")
+    state.watch_started([str(src)])
+    before = state.loaded_dir(str(src))
+
+    pictures = src / "sublevel1" / "Pictures"
+    (pictures / "new.jpg").write_text("new")
+    (src / "sublevel1" / "sublevel2" / "unseen.txt").write_text("unseen")
+    state.invalidate([(str(src), str(pictures), False)])
+    after = state.loaded_dir(str(src))
+
+    assert after is before
+    assert "new.jpg" in after.subdirs["sublevel1"].subdirs["Pictures"].files
+    # Nothing reported a change there, so the cached listing is kept
+    assert "unseen.txt" not in after.subdirs["sublevel1"].subdirs["sublevel2"].files
+
+
+def test_watched_trees_catch_up_before_requests(tmpdir, dirs):
+    src, cmp = dirs
+    tmp_path = Path(str(tmpdir))
+    state = sut.DaemonState(tmp_path / "central.toml", tmp_path / "catalog.db")
+    # Long enough that only syncing can explain the change showing up
+    watcher = Watcher([src], tmp_path / "catalog.db", flush_interval=60,
+                      on_change=state.invalidate, on_unwatched=state.unwatch)
+    state.watcher = watcher
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    assert watcher.ready.wait(5)
+    state.watch_started(watcher.roots)
+
+    try:
+        state.dispatch({"command": "compare", "args": {"src": str(src), "target": str(cmp)}})
+        (src / "sublevel1" / "Pictures" / "new.jpg").write_text("new")
+        res = state.dispatch({"command": "compare",
+                              "args": {"src": str(src), "target": str(cmp)}})
+    finally:
+        watcher.stop()
+        thread.join(5)
+        state.close()
+
+    assert ("file", "missing", "sublevel1/Pictures/new.jpg") in set(res["result"])
+
+
+def test_unwatched_subtrees_get_revalidated(tmpdir, dirs):
+    src, _ = dirs
+    state = sut.DaemonState(Path(str(tmpdir)) / "central.toml",
+                            Path(str(tmpdir)) / "catalog.db")
+    sublevel2 = src / "sublevel1" / "sublevel2"
+    state.watch_started([str(src)])
+    state.unwatch(str(sublevel2))
+    state.loaded_dir(str(src))
+
+    # Nothing reports this, so it's up to the directory's mtime
+    (sublevel2 / "unseen.txt").write_text("unseen")
+    after = state.loaded_dir(str(src))
+
+    assert "unseen.txt" in after.subdirs["sublevel1"].subdirs["sublevel2"].files
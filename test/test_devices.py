@@ -0,0 +1,214 @@
+import datetime as dt
+from pathlib import Path
+
+import pytest  # type: ignore
+
+import hearth.devices as sut
+from hearth.catalog import Catalog, rebased_path
+from hearth.sync_central import Device, SyncCentral, SyncInfo
+
+
+@pytest.fixture(scope="function")
+def system(tmpdir, monkeypatch):
+    """ Fake /dev/disk links and partitions that tests can replug """
+    tmp_path = Path(str(tmpdir))
+    by_uuid = tmp_path / "by-uuid"
+    by_label = tmp_path / "by-label"
+    by_uuid.mkdir()
+    by_label.mkdir()
+    monkeypatch.setattr(sut, "BY_UUID_PATH", by_uuid)
+    monkeypatch.setattr(sut, "BY_LABEL_PATH", by_label)
+
+    partitions = []
+    monkeypatch.setattr(sut, "mounted_partitions", lambda: list(partitions))
+
+    def plug(node, mountpoint, uuid=None, label=None):
+        node_path = tmp_path / node
+        node_path.touch()
+        if uuid:
+            (by_uuid / uuid).symlink_to(node_path)
+        if label:
+            (by_label / label.replace(" ", "\\x20")).symlink_to(node_path)
+
+        Path(mountpoint).mkdir(parents=True, exist_ok=True)
+        partitions.append((str(node_path), str(mountpoint)))
+
+    def unplug_all():
+        partitions.clear()
+        for d in (by_uuid, by_label):
+            for link in d.iterdir():
+                link.unlink()
+        for node in tmp_path.glob("sd*"):
+            node.unlink()
+
+    return plug, unplug_all
+
+
+def test_mounted_partitions(tmpdir, monkeypatch):
+    tmp_path = Path(str(tmpdir))
+    mounts = tmp_path / "mounts"
+    filesystems = tmp_path / "filesystems"
+    mounts.write_text(
+        "proc /proc proc rw,nosuid 0 0\n"
+        "/dev/sda1 / ext4 rw,relatime 0 0\n"
+        "/dev/sdb1 /media/My\\040Photos vfat rw 0 0\n"
+        "tmpfs /tmp tmpfs rw 0 0\n"
+    )
+    filesystems.write_text("nodev\tproc\nnodev\ttmpfs\n\text4\n\tvfat\n")
+    monkeypatch.setattr(sut, "MOUNTS_PATH", mounts)
+    monkeypatch.setattr(sut, "FILESYSTEMS_PATH", filesystems)
+
+    assert sut.mounted_partitions() == [("/dev/sda1", "/"),
+                                        ("/dev/sdb1", "/media/My Photos")]
+
+
+def test_fingerprinted_devices(system, tmpdir):
+    plug, _ = system
+    plug("sdb1", Path(str(tmpdir)) / "mnt" / "a", uuid="1234-ABCD", label="My Photos")
+    plug("sdc1", Path(str(tmpdir)) / "mnt" / "b")
+
+    devices = sut.fingerprinted_devices()
+
+    assert devices["uuid:1234-ABCD"].label == "My Photos"
+    assert devices["uuid:1234-ABCD"].name == "My Photos"
+    assert [k for k in devices if k != "uuid:1234-ABCD"] == [str(Path(str(tmpdir)) / "sdc1")]
+
+
+def test_marker_takes_precedence(system, tmpdir):
+    plug, _ = system
+    mountpoint = Path(str(tmpdir)) / "mnt" / "a"
+    plug("sdb1", mountpoint, uuid="1234-ABCD")
+
+    marker = sut.write_marker(mountpoint)
+
+    assert sut.write_marker(mountpoint) == marker
+    assert list(sut.fingerprinted_devices()) == [f"marker:{marker}"]
+
+
+def test_remount_moves_tracked_paths(system, tmpdir):
+    plug, unplug_all = system
+    tmp_path = Path(str(tmpdir))
+    old_mount = tmp_path / "mnt" / "a"
+    new_mount = tmp_path / "media" / "photos"
+    catalog_path = tmp_path / "catalog.db"
+
+    plug("sdb1", old_mount, uuid="1234-ABCD")
+    (old_mount / "pics").mkdir()
+    (old_mount / "pics" / "a.jpg").write_text("jpg")
+
+    now = dt.datetime.now()
+    infos = {"pics": SyncInfo("pics", "", "s1", {"s1": str(old_mount / "pics")})}
+    central = SyncCentral(str(tmp_path / "c.toml"),
+                          sut.fingerprinted_devices(), now, now, infos)
+    with Catalog(catalog_path) as catalog:
+        before = catalog.refresh_root(old_mount / "pics")
+
+    # Unplugged devices keep their last mountpoint
+    unplug_all()
+    assert sut.resolve_mountpoints(central, catalog_path)
+    assert not central.devices["uuid:1234-ABCD"].mounted
+
+    new_mount.parent.mkdir(parents=True)
+    old_mount.rename(new_mount)
+    plug("sdd1", new_mount, uuid="1234-ABCD")
+    assert sut.resolve_mountpoints(central, catalog_path)
+    assert not sut.resolve_mountpoints(central, catalog_path)
+
+    device = central.devices["uuid:1234-ABCD"]
+    assert device.mounted
+    assert device.mountpoint == str(new_mount)
+    assert device.node.endswith("sdd1")
+    assert infos["pics"].sources["s1"] == str(new_mount / "pics")
+
+    with Catalog(catalog_path) as catalog:
+        after = catalog.root_summary(new_mount / "pics")
+        assert catalog.root_summary(old_mount / "pics") is None
+
+    assert (after.total_size, after.total_files) == (before.total_size, before.total_files)
+
+
+def test_marking_rekeys_known_device(system, tmpdir):
+    plug, _ = system
+    mountpoint = Path(str(tmpdir)) / "mnt" / "a"
+    plug("sdb1", mountpoint, uuid="1234-ABCD")
+
+    now = dt.datetime.now()
+    central = SyncCentral("", sut.fingerprinted_devices(), now, now, {})
+    marker = sut.write_marker(mountpoint)
+
+    assert sut.resolve_mountpoints(central)
+    assert list(central.devices) == [f"marker:{marker}"]
+
+
+def test_other_disk_on_the_same_node_isnt_the_device(system, tmpdir):
+    plug, unplug_all = system
+    tmp_path = Path(str(tmpdir))
+    usb = tmp_path / "media" / "usb"
+    other = tmp_path / "media" / "other"
+
+    plug("sdb1", usb, uuid="AAAA")
+    now = dt.datetime.now()
+    infos = {"pics": SyncInfo("pics", "", "s1", {"s1": str(usb / "pics")})}
+    central = SyncCentral("", sut.fingerprinted_devices(), now, now, infos)
+    central.devices["uuid:AAAA"].name = "MyDrive"
+
+    unplug_all()
+    plug("sdb1", other, uuid="BBBB")
+    sut.resolve_mountpoints(central)
+
+    device = central.devices["uuid:AAAA"]
+    assert list(central.devices) == ["uuid:AAAA"]
+    assert not device.mounted
+    assert device.mountpoint == str(usb)
+    assert infos["pics"].sources["s1"] == str(usb / "pics")
+
+
+def test_devices_sharing_a_label_stay_apart(system, tmpdir):
+    plug, unplug_all = system
+    tmp_path = Path(str(tmpdir))
+    plug("sdb1", tmp_path / "mnt" / "a", uuid="AAAA", label="Photos")
+    now = dt.datetime.now()
+    central = SyncCentral("", sut.fingerprinted_devices(), now, now, {})
+
+    unplug_all()
+    plug("sdc1", tmp_path / "mnt" / "b", uuid="BBBB", label="Photos")
+    central.devices.update(sut.fingerprinted_devices())
+    sut.resolve_mountpoints(central)
+
+    assert not central.devices["uuid:AAAA"].mounted
+    assert central.devices["uuid:AAAA"].mountpoint == str(tmp_path / "mnt" / "a")
+    assert central.devices["uuid:BBBB"].mounted
+    assert central.devices["uuid:BBBB"].mountpoint == str(tmp_path / "mnt" / "b")
+
+
+def test_fingerprints_devices_recorded_before_upgrade(system, tmpdir):
+    plug, _ = system
+    tmp_path = Path(str(tmpdir))
+    plug("sdb1", tmp_path / "mnt" / "a", uuid="1234-ABCD")
+    plug("sdc1", tmp_path / "mnt" / "b")
+
+    # What `init` used to record: just the device node and its mountpoint
+    now = dt.datetime.now()
+    old_devices = {
+        str(tmp_path / "sdb1"): Device(str(tmp_path / "sdb1"), str(tmp_path / "mnt" / "a")),
+        "/dev/gone": Device("/dev/gone", str(tmp_path / "mnt" / "b")),
+    }
+    central = SyncCentral("", old_devices, now, now, {})
+
+    assert sut.resolve_mountpoints(central)
+    assert not sut.resolve_mountpoints(central)
+
+    assert sorted(central.devices) == [str(tmp_path / "sdc1"), "uuid:1234-ABCD"]
+    assert all(d.mounted for d in central.devices.values())
+    assert central.devices["uuid:1234-ABCD"].node == str(tmp_path / "sdb1")
+
+
+@pytest.mark.parametrize("moves, path, expected", [
+    ({"/mnt/a": "/media/x"}, "/mnt/a", "/media/x"),
+    ({"/mnt/a": "/media/x"}, "/mnt/a/pics", "/media/x/pics"),
+    ({"/mnt/a": "/media/x"}, "/mnt/ab", None),
+    ({"/mnt/a": "/media/x", "/mnt/a/b": "/srv"}, "/mnt/a/b/c", "/srv/c"),
+    ({"/": "/mnt/old-root"}, "/home/me", "/mnt/old-root/home/me"),
+])
+def test_rebased_path(moves, path, expected):
+    assert rebased_path(path, moves) == expected
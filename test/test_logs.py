@@ -0,0 +1,36 @@
+import json
+import logging
+
+import hearth.logs as sut
+
+
+def test_json_formatter_includes_extra_fields():
+    record = logging.makeLogRecord({
+        "name": "hearth.test",
+        "levelno": logging.INFO,
+        "levelname": "INFO",
+        "msg": "Copied %d files",
+        "args": (3,),
+        "device": "8:1",
+    })
+
+    payload = json.loads(sut.JsonFormatter().format(record))
+
+    assert payload["msg"] == "Copied 3 files"
+    assert payload["level"] == "info"
+    assert payload["device"] == "8:1"
+
+
+def test_logs_stay_off_stdout(capsys):
+    root_logger = logging.getLogger()
+    handlers, level = root_logger.handlers[:], root_logger.level
+    try:
+        sut.configure_logging("info")
+        logging.getLogger("hearth.test").info("Relocated")
+    finally:
+        root_logger.handlers[:] = handlers
+        root_logger.setLevel(level)
+
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "Relocated" in captured.err
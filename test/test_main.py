@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+import pytest  # type: ignore
+
+
+@pytest.mark.parametrize("module", [
+    "psutil",
+    "sqlite3",
+    "toml",
+    "hearth.daemon",
+    "hearth.dir.diff",
+])
+def test_import_stays_light(module):
+    """ Heavy dependencies are only imported by the commands using them """
+    code = f"import sys, hearth.main; print({module!r} in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code],
+                         stdout=subprocess.PIPE, check=True).stdout
+
+    assert out.strip() == b"False"
+
+
+@pytest.mark.parametrize("module", [
+    "psutil",
+    "sqlite3",
+    "hearth.daemon",
+    "hearth.stats",
+    "hearth.watch",
+    "hearth.rules",
+])
+def test_client_stays_light(module):
+    """ Commands import the daemon client before knowing whether one runs """
+    code = f"import sys, hearth.client; print({module!r} in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code],
+                         stdout=subprocess.PIPE, check=True).stdout
+
+    assert out.strip() == b"False"
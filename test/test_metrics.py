@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import pytest  # type: ignore
+
+import helpers.dir_schemas
+from hearth.dir.data import loaded_dir
+from hearth.dir.diff import full_diff_dirs
+from hearth.dir.sync import apply_copy, sync_plan
+from hearth.metrics import Metrics, metrics
+from helpers.dir_schemas import create_dir
+
+
+@pytest.fixture(scope="function")
+def enabled_metrics():
+    metrics.enable()
+    yield metrics
+    metrics.enabled = False
+    metrics.clear()
+
+
+def test_disabled_metrics_record_nothing():
+    m = Metrics()
+
+    m.count("dirs_listed")
+    with m.phase("scan"):
+        pass
+    m.transfer(".", 10, 1.0)
+
+    assert m.report() == {"phases": {}, "counters": {}, "devices": {}}
+
+
+def test_phases_add_up():
+    m = Metrics(enabled=True)
+
+    for _ in range(3):
+        with m.phase("scan"):
+            pass
+
+    assert list(m.phases) == ["scan"]
+    assert m.phases["scan"] > 0
+
+
+def test_instrumented_sync(enabled_metrics, tmpdir_factory):
+    master = Path(str(tmpdir_factory.mktemp("master")))
+    backup = Path(str(tmpdir_factory.mktemp("backup")))
+    create_dir(master, helpers.dir_schemas.multiple_subdir_levels(master),
+               empty_files=False)
+
+    diff = full_diff_dirs(loaded_dir(master), loaded_dir(backup))
+    for op in sync_plan(master, backup, diff):
+        apply_copy(op)
+
+    counters = enabled_metrics.counters
+    assert counters["dirs_listed"] == 6
+    assert counters["files_copied"] == 10
+    assert counters["bytes_copied"] == sum(
+        p.stat().st_size for p in master.rglob("*") if p.is_file())
+
+    [transfer] = enabled_metrics.report()["devices"].values()
+    assert transfer["bytes"] == counters["bytes_copied"]
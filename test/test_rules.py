@@ -0,0 +1,139 @@
+import datetime as dt
+import os
+import shutil
+from pathlib import Path
+
+import pytest  # type: ignore
+
+import hearth.rules as sut
+from hearth.dir.data import loaded_dir
+from hearth.dir.diff import full_diff_dirs
+from hearth.dir.pipeline import pipelined_diff
+from hearth.metrics import metrics
+from hearth.sync_central import ScanRules, SyncCentral, SyncInfo
+
+
+def _no_stat():
+    raise AssertionError("stat shouldn't be needed")
+
+
+@pytest.mark.parametrize("pattern, path, is_dir, skipped", [
+    ("*.tmp", "a.tmp", False, True),
+    ("*.tmp", "deep/down/a.tmp", False, True),
+    ("*.tmp", "a.tmp.jpg", False, False),
+    (".Trash/", ".Trash", True, True),
+    (".Trash/", "sub/.Trash", True, True),
+    (".Trash/", ".Trash", False, False),
+    ("pics/raw", "pics/raw", True, True),
+    ("pics/raw", "other/pics/raw", True, False),
+    ("/cache", "cache", True, True),
+    ("/cache", "sub/cache", True, False),
+])
+def test_exclude_globs(pattern, path, is_dir, skipped):
+    matcher = sut.compile_rules(ScanRules(exclude=[pattern]), "/root")
+
+    if is_dir:
+        assert matcher.skips_dir(path) == skipped
+    else:
+        assert matcher.skips_file(path, _no_stat) == skipped
+
+
+def test_include_only_filters_files():
+    matcher = sut.compile_rules(ScanRules(include=["*.jpg"]), "/root")
+
+    assert not matcher.skips_file("a/b.jpg", _no_stat)
+    assert matcher.skips_file("a/b.png", _no_stat)
+    assert not matcher.skips_dir("a")
+
+
+def test_size_and_time_rules(tmpdir):
+    f = Path(str(tmpdir)) / "f"
+    f.write_bytes(b"12345")
+    os.utime(str(f), (0, dt.datetime(2020, 6, 1).timestamp()))
+
+    def skips(**rules):
+        return sut.compile_rules(ScanRules(**rules), str(tmpdir)).skips_file("f", f.stat)
+
+    assert not skips(min_size=5, max_size=5)
+    assert skips(min_size=6)
+    assert skips(max_size=4)
+    assert not skips(newer_than=dt.datetime(2020, 1, 1))
+    assert skips(newer_than=dt.datetime(2021, 1, 1))
+    assert skips(older_than=dt.datetime(2020, 1, 1))
+
+
+@pytest.fixture(scope="function")
+def tree(tmpdir):
+    root = Path(str(tmpdir)) / "root"
+    for d in ["a/cache", "a/keep", "b/cache", ".Trash"]:
+        (root / d).mkdir(parents=True)
+    for f in ["a/cache/x", "a/keep/y.jpg", "a/keep/z.log", "b/cache/w", ".Trash/t", "top.log"]:
+        (root / f).write_text(f)
+    (root / "a" / sut.IGNORE_FILENAME).write_text("# caches\n\ncache/\n/keep/*.log\n")
+
+    yield root
+
+
+def test_loaded_dir_skips_excluded_subtrees(tree):
+    matcher = sut.compile_rules(ScanRules(exclude=[".Trash/"]), tree)
+    metrics.enable()
+    try:
+        dir_ = loaded_dir(tree, matcher)
+        listed = metrics.counters["dirs_listed"]
+    finally:
+        metrics.enabled = False
+        metrics.clear()
+
+    assert set(dir_.subdirs) == {"a", "b"}
+    assert set(dir_.subdirs["a"].subdirs) == {"keep"}
+    assert dir_.subdirs["a"].subdirs["keep"].files == {"y.jpg"}
+    # The ignore file only covers its own directory
+    assert set(dir_.subdirs["b"].subdirs) == {"cache"}
+    # root, a, a/keep, b and b/cache
+    assert listed == 5
+
+
+def test_compile_rules_below_root(tree):
+    matcher = sut.compile_rules(ScanRules(), tree, tree / "a" / "keep")
+
+    assert loaded_dir(tree / "a" / "keep", matcher).files == {"y.jpg"}
+
+
+def test_copy_ignore(tree, tmpdir):
+    matcher = sut.compile_rules(ScanRules(exclude=["*.jpg"]), tree)
+    dst = Path(str(tmpdir)) / "copy"
+
+    shutil.copytree(str(tree / "a"), str(dst), ignore=matcher.copy_ignore(tree))
+
+    assert sorted(str(p.relative_to(dst)) for p in dst.rglob("*")) == [
+        sut.IGNORE_FILENAME, "keep"
+    ]
+
+
+def test_pipelined_diff_applies_rules(tree, tmpdir):
+    backup = Path(str(tmpdir)) / "backup"
+    backup.mkdir()
+    (backup / "top.log").write_text("changed")
+    rules = ScanRules(exclude=["*.log", ".Trash/"])
+    matchers = [sut.compile_rules(rules, tree), sut.compile_rules(rules, backup)]
+
+    expected = full_diff_dirs(loaded_dir(tree, matchers[0]), loaded_dir(backup, matchers[1]))
+    diff = pipelined_diff(tree, backup, jobs=2, matchers=matchers)
+
+    assert diff == expected
+    assert diff.subdirs.missing == {"a", "b"}
+    assert not diff.files
+
+
+def test_matchers_for(tree, tmpdir):
+    backup = Path(str(tmpdir)) / "backup"
+    rules = ScanRules(exclude=["*.log"])
+    infos = {"media": SyncInfo("media", "", "s1", {"s1": str(tree), "s2": str(backup)}, rules)}
+    now = dt.datetime.now()
+    central = SyncCentral("", {}, now, now, infos)
+
+    src, dst = sut.matchers_for(central, tree / "a", backup)
+
+    assert src.rules is rules and src.prefix == "a"
+    assert dst.rules is rules and dst.prefix == ""
+    assert sut.matchers_for(central, tmpdir / "elsewhere") is None
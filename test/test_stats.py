@@ -0,0 +1,48 @@
+import datetime as dt
+from pathlib import Path
+
+import pytest  # type: ignore
+
+import hearth.stats as sut
+from hearth.catalog import Catalog
+from hearth.sync_central import Device, SyncCentral, SyncInfo
+
+
+@pytest.fixture(scope="function")
+def central(tmpdir):
+    now = dt.datetime.now()
+    root = Path(str(tmpdir)) / "root"
+    root.mkdir()
+    (root / "a.txt").write_bytes(b"abc")
+
+    infos = {"media": SyncInfo("media", "", "s1", {"s1": str(root)})}
+    devices = {
+        "here": Device("here", str(tmpdir)),
+        "gone": Device("gone", str(Path(str(tmpdir)) / "unplugged")),
+    }
+
+    return SyncCentral(str(Path(str(tmpdir)) / "c.toml"), devices, now, now, infos)
+
+
+def test_tracked_roots(central):
+    assert sut.tracked_roots(central) == {central.sync_infos["media"].sources["s1"]}
+
+
+def test_device_stats_skips_unmounted(central):
+    stats = sut.device_stats(central.devices)
+
+    assert [d.name for d in stats] == ["here"]
+    assert stats[0].total >= stats[0].used
+
+
+def test_gather_stats(central, tmpdir):
+    root = central.sync_infos["media"].sources["s1"]
+
+    with Catalog(Path(str(tmpdir)) / "catalog.db") as catalog:
+        before = sut.gather_stats(central, catalog)
+        after = sut.gather_stats(central, catalog, refresh=True)
+
+    assert before.roots == {root: None}
+    assert after.roots[root].total_size == 3
+    assert after.roots[root].total_files == 1
+    assert after.total_capacity == after.devices[0].total
@@ -59,3 +59,42 @@ def test_save_and_get_dirsync_toml(tmpdir):
     actual_central = sut.get_sync_central(sample_file)
 
     assert expected_central == actual_central
+
+
+def test_save_and_get_scan_rules(tmpdir):
+    sample_file = Path(str(tmpdir)) / "sample.toml"
+    central = generate_sample_sync_central(sample_file)
+    central.sync_infos["sample1"].rules = sut.ScanRules(
+        include=["*.jpg"],
+        exclude=[".Trash/", "@eaDir/"],
+        min_size=1024,
+        newer_than=dt.datetime(2020, 1, 1),
+        ignore_files=False
+    )
+
+    sut.save_sync_central(central, create_if_exists=True)
+
+    assert sut.get_sync_central(sample_file) == central
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("/media/pics", ("pics", "/media/pics")),
+    ("/media/pics/2020/", ("pics", "/media/pics")),
+    ("/media/pics/raw/a", ("raw", "/media/pics/raw")),
+    ("/media/picsum", None),
+    ("/elsewhere", None),
+])
+def test_sync_info_for(path, expected):
+    now = dt.datetime.now()
+    infos = {
+        "pics": sut.SyncInfo("pics", "", "s1", {"s1": "/media/pics"}),
+        "raw": sut.SyncInfo("raw", "", "s1", {"s1": "/media/pics/raw/"}),
+    }
+    central = sut.SyncCentral("", {}, now, now, infos)
+
+    found = sut.sync_info_for(central, path)
+
+    if expected is None:
+        assert found is None
+    else:
+        assert (found[0].name, found[1]) == expected
@@ -0,0 +1,46 @@
+from pathlib import Path
+
+import pytest  # type: ignore
+
+from hearth.dir.data import loaded_dir
+from hearth.dir.diff import full_diff_dirs
+from helpers.tree_gen import TreeSpec, generate_tree, mutate_tree
+
+
+@pytest.mark.parametrize("spec", [
+    TreeSpec(depth=0, fanout=0, files_per_dir=5, file_size=10),
+    TreeSpec(depth=3, fanout=1, files_per_dir=2, file_size=0),
+    TreeSpec(depth=2, fanout=3, files_per_dir=4, file_size=3000),
+])
+def test_generate_tree(tmpdir, spec):
+    path = Path(str(tmpdir))
+    files = generate_tree(path, spec)
+
+    on_disk = [p for p in path.rglob("*") if p.is_file()]
+    assert len(files) == len(on_disk) == spec.num_files
+    assert sum(1 for p in path.rglob("*") if p.is_dir()) + 1 == spec.num_dirs
+    assert all(p.stat().st_size == spec.file_size for p in on_disk)
+
+
+def test_mutate_tree(tmpdir_factory):
+    spec = TreeSpec(depth=1, fanout=3, files_per_dir=10, file_size=100)
+    src = Path(str(tmpdir_factory.mktemp("src")))
+    cmp = Path(str(tmpdir_factory.mktemp("cmp")))
+    generate_tree(src, spec, seed=1)
+    cmp_files = generate_tree(cmp, spec, seed=1)
+
+    mutation = mutate_tree(cmp_files, change_rate=0.3, seed=2)
+    diff = full_diff_dirs(loaded_dir(src), loaded_dir(cmp))
+
+    assert len(diff.files.changed) == len(mutation.changed) == 4
+    assert len(diff.files.missing) == len(mutation.removed) == 4
+    assert len(diff.files.new) == len(mutation.added) == 4
+
+
+def test_mutate_tree_touches_a_minimum(tmpdir):
+    spec = TreeSpec(depth=1, fanout=2, files_per_dir=2, file_size=100)
+    files = generate_tree(Path(str(tmpdir)), spec, seed=1)
+
+    mutation = mutate_tree(files, change_rate=0.05, seed=2, min_changes=3)
+
+    assert len(mutation.changed) == len(mutation.removed) == len(mutation.added) == 1
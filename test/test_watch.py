@@ -0,0 +1,156 @@
+import errno
+import threading
+import time
+from pathlib import Path
+
+import pytest  # type: ignore
+
+import hearth.watch as sut
+import helpers.dir_schemas
+from hearth.catalog import Catalog
+from helpers.dir_schemas import create_dir
+
+try:
+    sut.Inotify().close()
+except sut.WatchError:
+    pytest.skip("inotify isn't available", allow_module_level=True)
+
+
+@pytest.fixture(scope="function")
+def root_path(tmpdir_factory):
+    path = Path(str(tmpdir_factory.mktemp("root")))
+    create_dir(path,
+               helpers.dir_schemas.multiple_subdir_levels(path),
+               empty_files=False)
+
+    return path
+
+
+@pytest.fixture(scope="function")
+def watched(tmpdir, root_path):
+    catalog_path = Path(str(tmpdir)) / "catalog.db"
+    with Catalog(catalog_path) as catalog:
+        catalog.refresh_root(root_path)
+
+    batches = []
+    watcher = sut.Watcher([root_path], catalog_path, flush_interval=0.05,
+                          on_change=batches.append)
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    assert watcher.ready.wait(5)
+
+    with Catalog(catalog_path) as catalog:
+        # Consume the journal entry made when the watcher started
+        catalog.refresh_root(root_path)
+        yield catalog, watcher, batches
+
+    watcher.stop()
+    thread.join()
+
+
+def _wait_for(batches, count=1):
+    deadline = time.monotonic() + 5
+    while len(batches) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def _disk_totals(path: Path):
+    sizes = [p.stat().st_size for p in path.rglob("*") if p.is_file()]
+    return sum(sizes), len(sizes)
+
+
+def test_journals_changed_directories(watched, root_path):
+    catalog, watcher, batches = watched
+    batches.clear()
+
+    pictures = root_path / "sublevel1" / "Pictures"
+    (pictures / "img3.jpg").write_text("new picture")
+    _wait_for(batches)
+
+    changed = {path for batch in batches for _, path, _ in batch}
+    assert changed == {str(pictures)}
+
+
+def test_picks_up_in_place_edits(watched, root_path):
+    catalog, watcher, batches = watched
+    batches.clear()
+
+    # Rewriting a file keeps its directory's mtime, which mtime scans miss
+    secret = root_path / "sublevel1" / "sublevel2" / "Secret Pictures" / "SECRET.png"
+    with secret.open("a") as f:
+        f.write("x" * 1000)
+    _wait_for(batches)
+
+    summary = catalog.refresh_root(root_path)
+    assert (summary.total_size, summary.total_files) == _disk_totals(root_path)
+
+
+def test_tracks_new_subdirectories(watched, root_path):
+    catalog, watcher, batches = watched
+    batches.clear()
+
+    new_dir = root_path / "sublevel1" / "new"
+    new_dir.mkdir()
+    _wait_for(batches)
+    (new_dir / "a.txt").write_text("a" * 10)
+    _wait_for(batches, 2)
+
+    summary = catalog.refresh_root(root_path)
+    assert (summary.total_size, summary.total_files) == _disk_totals(root_path)
+
+
+def test_sync_journals_without_waiting_for_a_flush(tmpdir, root_path):
+    catalog_path = Path(str(tmpdir)) / "catalog.db"
+    batches = []
+    watcher = sut.Watcher([root_path], catalog_path, flush_interval=60,
+                          on_change=batches.append)
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    assert watcher.ready.wait(5)
+    batches.clear()
+
+    pictures = root_path / "sublevel1" / "Pictures"
+    (pictures / "img3.jpg").write_text("new picture")
+    synced = watcher.sync(5)
+
+    watcher.stop()
+    thread.join(5)
+
+    assert synced
+    assert {path for _, path, _ in batches[0]} == {str(pictures)}
+    assert not thread.is_alive()
+
+
+def test_out_of_watches_falls_back_to_rescans(tmpdir, root_path, monkeypatch):
+    unwatchable = str(root_path / "sublevel1" / "sublevel2")
+    add_watch = sut.Inotify.add_watch
+
+    def limited_add_watch(self, path, *args):
+        if path == unwatchable:
+            raise OSError(errno.ENOSPC, "No space left on device", path)
+        return add_watch(self, path, *args)
+
+    monkeypatch.setattr(sut.Inotify, "add_watch", limited_add_watch)
+
+    catalog_path = Path(str(tmpdir)) / "catalog.db"
+    unwatched = []
+    watcher = sut.Watcher([root_path], catalog_path, flush_interval=0.05,
+                          on_unwatched=unwatched.append)
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    assert watcher.ready.wait(5)
+    assert unwatched == [unwatchable]
+
+    with Catalog(catalog_path) as catalog:
+        catalog.refresh_root(root_path)
+
+        # Not journaled, since nothing watches that subtree
+        with (Path(unwatchable) / "ugh.js").open("a") as f:
+            f.write("y" * 100)
+
+        summary = catalog.refresh_root(root_path)
+
+    watcher.stop()
+    thread.join()
+
+    assert (summary.total_size, summary.total_files) == _disk_totals(root_path)